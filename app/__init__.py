@@ -1,16 +1,10 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from sqlalchemy import event
 from config import Config
 
-# OAuth blueprints (Flask-Dance)
-try:
-    from flask_dance.contrib.google import make_google_blueprint
-    from flask_dance.contrib.github import make_github_blueprint
-    from flask_dance.contrib.discord import make_discord_blueprint
-    FLASK_DANCE_AVAILABLE = True
-except Exception:
-    FLASK_DANCE_AVAILABLE = False
+import importlib
 
 # Extensions
 db = SQLAlchemy()
@@ -18,6 +12,30 @@ login_manager = LoginManager()
 login_manager.login_view = "auth.login_page"
 
 
+def _flask_dance_factory(provider: str):
+    """Import ``make_<provider>_blueprint`` from Flask-Dance on demand; None if unavailable.
+
+    Flask-Dance pulls in oauthlib and requests-oauthlib, so providers that are
+    not configured are never imported.
+    """
+    try:
+        module = importlib.import_module(f"flask_dance.contrib.{provider}")
+    except Exception:
+        return None
+    return getattr(module, f"make_{provider}_blueprint")
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={Config.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={int(Config.SQLITE_BUSY_TIMEOUT_MS)}")
+        cursor.execute(f"PRAGMA mmap_size={int(Config.SQLITE_MMAP_SIZE)}")
+    finally:
+        cursor.close()
+
+
 def create_app() -> Flask:
     app = Flask(__name__, instance_relative_config=True, template_folder="templates", static_folder="static")
     app.config.from_object(Config)
@@ -26,6 +44,22 @@ def create_app() -> Flask:
     db.init_app(app)
     login_manager.init_app(app)
 
+    # Tune SQLite connections as they are opened (see Config.SQLITE_*)
+    if Config.SQLITE_TUNING:
+        with app.app_context():
+            if db.engine.dialect.name == "sqlite":
+                event.listen(db.engine, "connect", _sqlite_pragmas)
+
+    # Request, SQL and AI backend metrics for /metrics
+    if Config.METRICS:
+        from . import metrics
+        metrics.init_app(app)
+
+    # Server-Timing spans and sampled profiling of slow requests
+    if Config.SERVER_TIMING or Config.PROFILE_SAMPLE_RATE > 0:
+        from . import timing
+        timing.init_app(app)
+
     # Import parts
     from . import models  # noqa: F401
     from .auth import auth_bp
@@ -35,10 +69,23 @@ def create_app() -> Flask:
     app.register_blueprint(auth_bp)
     app.register_blueprint(main_bp)
 
+    # Generated images kept outside the static folder (IMAGE_STORE_DIR)
+    from . import image_store
+    image_store.init_app(app)
+
+    # CLI commands
+    from .pregenerate import pregenerate_command
+    app.cli.add_command(pregenerate_command)
+
+    # Template helpers
+    from .image_store import variants as image_variants
+    app.jinja_env.globals["image_variants"] = image_variants
+
     # Register OAuth provider blueprints (Flask-Dance)
-    if FLASK_DANCE_AVAILABLE:
-        # Google -> /auth/google
-        if Config.GOOGLE_CLIENT_ID and Config.GOOGLE_CLIENT_SECRET:
+    # Google -> /auth/google
+    if Config.GOOGLE_CLIENT_ID and Config.GOOGLE_CLIENT_SECRET:
+        make_google_blueprint = _flask_dance_factory("google")
+        if make_google_blueprint:
             google_bp = make_google_blueprint(
                 client_id=Config.GOOGLE_CLIENT_ID,
                 client_secret=Config.GOOGLE_CLIENT_SECRET,
@@ -46,8 +93,10 @@ def create_app() -> Flask:
                 redirect_to="auth.oauth_finalize_google",
             )
             app.register_blueprint(google_bp, url_prefix="/auth")
-        # GitHub -> /auth/github
-        if getattr(Config, "GITHUB_CLIENT_ID", None) and getattr(Config, "GITHUB_CLIENT_SECRET", None):
+    # GitHub -> /auth/github
+    if getattr(Config, "GITHUB_CLIENT_ID", None) and getattr(Config, "GITHUB_CLIENT_SECRET", None):
+        make_github_blueprint = _flask_dance_factory("github")
+        if make_github_blueprint:
             github_bp = make_github_blueprint(
                 client_id=Config.GITHUB_CLIENT_ID,
                 client_secret=Config.GITHUB_CLIENT_SECRET,
@@ -55,8 +104,10 @@ def create_app() -> Flask:
                 redirect_to="auth.oauth_finalize_github",
             )
             app.register_blueprint(github_bp, url_prefix="/auth")
-        # Discord -> /auth/discord
-        if getattr(Config, "DISCORD_CLIENT_ID", None) and getattr(Config, "DISCORD_CLIENT_SECRET", None):
+    # Discord -> /auth/discord
+    if getattr(Config, "DISCORD_CLIENT_ID", None) and getattr(Config, "DISCORD_CLIENT_SECRET", None):
+        make_discord_blueprint = _flask_dance_factory("discord")
+        if make_discord_blueprint:
             discord_bp = make_discord_blueprint(
                 client_id=Config.DISCORD_CLIENT_ID,
                 client_secret=Config.DISCORD_CLIENT_SECRET,
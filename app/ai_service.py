@@ -1,99 +1,68 @@
-import os
-from typing import List, Tuple
+import time
+from typing import List, NamedTuple, Tuple
 
-import requests
 import re
 
-try:
-	from openai import OpenAI
-	OPENAI_AVAILABLE = True
-except Exception:
-	OPENAI_AVAILABLE = False
+from config import Config
+from . import image_store, metrics
+from .health import HealthRegistry
+from .providers import load_provider
+from .transport import HTTPTransport
 
-try:
-	import google.generativeai as genai
-	GEMINI_AVAILABLE = True
-except Exception:
-	GEMINI_AVAILABLE = False
 
-from config import Config
+class ChapterDraft(NamedTuple):
+	content: str
+	choices: List[str]
+	image_url: str | None
+	# Ollama KV context after this chapter as (model, token ids), when the backend returns one
+	llm_context: Tuple[str, List[int]] | None = None
+	# Placeholder text because the model returned nothing; not worth illustrating or sharing
+	stub: bool = False
 
 
 class AIService:
 	def __init__(self, api_key: str | None):
 		self.provider = (Config.AI_PROVIDER or "ollama").lower()
 		self.api_key = api_key
-		self.ollama_base = Config.OLLAMA_BASE_URL.rstrip("/") if Config.OLLAMA_BASE_URL else "http://127.0.0.1:11434"
-		# Support comma-separated list of models for fallback, e.g. "llama3.1:70b, llama3.1:8b, llama3.2"
-		ollama_models = (Config.OLLAMA_MODEL or "llama3.2").split(",")
-		self.ollama_models: List[str] = [m.strip() for m in ollama_models if m.strip()]
-		self.client = OpenAI(api_key=api_key) if (self.provider == "openai" and api_key and OPENAI_AVAILABLE) else None
-		
-		# Initialize Gemini
-		if self.provider == "gemini" and api_key and GEMINI_AVAILABLE:
-			genai.configure(api_key=api_key)
-			# Try different model names in order of preference (using the correct model names)
-			model_names = [
-				'gemini-2.5-flash',
-				'gemini-2.0-flash', 
-				'gemini-flash-latest',
-				'gemini-pro-latest'
-			]
-			self.gemini_model = None
-			for model_name in model_names:
-				try:
-					self.gemini_model = genai.GenerativeModel(model_name)
-					# Test the model with a simple request
-					test_response = self.gemini_model.generate_content("test")
-					if test_response and hasattr(test_response, 'text'):
-						print(f"Successfully initialized Gemini with model: {model_name}")
-						break
-				except Exception as e:
-					print(f"Failed to initialize model {model_name}: {e}")
-					continue
-		else:
-			self.gemini_model = None
-			
+		self.transport = HTTPTransport()
+		self.health = HealthRegistry()
 		self.sd_base = Config.SD_BASE_URL.rstrip("/")
 		self.sd_negative = Config.SD_NEGATIVE_PROMPT
+		self.comfy_base = Config.COMFYUI_BASE_URL.rstrip("/") if Config.COMFYUI_BASE_URL else None
+		self.health.set_probe("sd", lambda: self.probe("sd", "GET", f"{self.sd_base}/sdapi/v1/sd-models"))
+		if self.comfy_base:
+			self.health.set_probe("comfyui", lambda: self.probe("comfyui", "GET", f"{self.comfy_base}/sdapi/v1/sd-models"))
+		# Only the configured provider's module (and SDK) is imported; None means stub mode
+		self.backend = load_provider(self.provider, self)
+		# Other providers that hedged chapter requests may also try
+		self.hedge_backends = []
+		if Config.HEDGE_REQUESTS:
+			self.hedge_backends = [b for b in (load_provider(n, self) for n in Config.HEDGE_PROVIDERS if n != self.provider) if b]
 
-	def _ollama_generate(self, prompt: str) -> str:
-		# Try configured models in order until one returns non-empty text
-		for model_name in self.ollama_models:
-			try:
-				resp = requests.post(
-					f"{self.ollama_base}/api/generate",
-					json={
-						"model": model_name,
-						"prompt": prompt,
-						"stream": False,
-						"options": {"temperature": 0.2, "num_ctx": 8192},
-					},
-					timeout=120,
-				)
-				resp.raise_for_status()
-				data = resp.json()
-				text = (data.get("response", "") or "").strip()
-				if text:
-					return text
-			except Exception:
-				continue
-		return ""
+	def probe(self, backend: str, method: str, url: str, **kwargs) -> bool:
+		resp = self.transport.request(method, backend, url, read_timeout=Config.HEALTH_PROBE_TIMEOUT, **kwargs)
+		return resp.ok
 
-	def _gemini_generate(self, prompt: str) -> str:
-		"""Generate text using Gemini API"""
-		if not self.gemini_model:
-			return ""
-		try:
-			response = self.gemini_model.generate_content(prompt)
-			if response and hasattr(response, 'text') and response.text:
-				return response.text.strip()
-			else:
-				print(f"Gemini response was empty or invalid: {response}")
-				return ""
-		except Exception as e:
-			print(f"Gemini generation failed: {e}")
-			return ""
+	@property
+	def model_label(self) -> str:
+		"""Identify the text model in use, for keying cached outputs."""
+		return self.backend.label if self.backend else "stub"
+
+	def _generate(self, prompt: str, max_tokens: int = 600) -> str:
+		return self.backend.generate(prompt, max_tokens=max_tokens) if self.backend else ""
+
+	@property
+	def keeps_context(self) -> bool:
+		"""Whether chapters can continue from the backend's KV context (Ollama only)."""
+		return Config.OLLAMA_CONTEXT_REUSE and getattr(self.backend, "keeps_context", False)
+
+	def _reusable_context(self, llm_context: Tuple[str, List[int]] | None) -> Tuple[str, List[int]] | None:
+		if not llm_context or not self.keeps_context:
+			return None
+		# Past the cap, start over from the rolling summary so the window stays bounded
+		if len(llm_context[1]) > Config.OLLAMA_CONTEXT_MAX_TOKENS:
+			return None
+		return llm_context
 
 	def _parse_names(self, text: str) -> List[str]:
 		if not text:
@@ -149,81 +118,77 @@ class AIService:
 				result.append(raw)
 		return result
 
-	def _sd_txt2img(self, prompt: str, out_dir: str, name_hint: str) -> str | None:
+	def _txt2img_params(self, prompt: str) -> dict:
+		return {
+			"prompt": prompt,
+			"negative_prompt": self.sd_negative,
+			"steps": 22,
+			"width": 768,
+			"height": 512,
+		}
+
+	def _txt2img_request(self, backend: str, base: str, prompt: str) -> bytes | None:
+		"""POST an Automatic1111-style txt2img request and return the first image's bytes."""
+		if not self.health.breaker(backend).allow():
+			print(f"Skipping {backend} image generation: circuit open")
+			return None
+		start = time.monotonic()
 		try:
-			# If a ComfyUI base URL is configured, try to use it first. Many
-			# ComfyUI HTTP plugins expose an Automatic1111-compatible /sdapi/v1/txt2img
-			# endpoint or a similar endpoint; apps can set COMFYUI_BASE_URL to point
-			# to such a server. If that fails, fall back to SD_BASE_URL.
-			comfy_base = getattr(self, 'comfy_base', None) or getattr(self, 'sd_base', None)
-			if getattr(Config, 'COMFYUI_BASE_URL', None):
-				comfy_base = Config.COMFYUI_BASE_URL.rstrip('/')
-			if comfy_base and comfy_base != self.sd_base:
-				try:
-					resp = requests.post(
-						f"{comfy_base}/sdapi/v1/txt2img",
-						json={
-							"prompt": prompt,
-							"negative_prompt": self.sd_negative,
-							"steps": 22,
-							"width": 768,
-							"height": 512,
-						},
-						timeout=180,
-					)
-					resp.raise_for_status()
-					data = resp.json()
-					imgs = data.get("images", [])
-					if imgs:
-						import base64
-						b64 = imgs[0]
-						if "," in b64:
-							b64 = b64.split(",", 1)[1]
-						binary = base64.b64decode(b64)
-						filename = f"{name_hint}.png".replace("/", "_")
-						path = os.path.join(out_dir, filename)
-						with open(path, "wb") as f:
-							f.write(binary)
-						return "/static/generated/" + filename
-				except Exception as e:
-					print(f"ComfyUI image generation failed: {e}")
-					# on any failure, we'll fall back to sd_base below
-					pass
-			os.makedirs(out_dir, exist_ok=True)
-			resp = requests.post(
-				f"{self.sd_base}/sdapi/v1/txt2img",
-				json={
-					"prompt": prompt,
-					"negative_prompt": self.sd_negative,
-					"steps": 22,
-					"width": 768,
-					"height": 512,
-				},
-				timeout=180,
+			resp = self.transport.post(
+				backend,
+				f"{base}/sdapi/v1/txt2img",
+				json=self._txt2img_params(prompt),
+				read_timeout=Config.SD_READ_TIMEOUT,
 			)
 			resp.raise_for_status()
 			data = resp.json()
-			imgs = data.get("images", [])
-			if not imgs:
+		except Exception as e:
+			self.health.failure(backend, e)
+			metrics.ai_call(backend, "txt2img", time.monotonic() - start, ok=False, phase="sd")
+			raise
+		except BaseException:
+			# Abandoned mid-call (worker shutdown): free the half-open trial without an outcome
+			self.health.breaker(backend).release()
+			raise
+		self.health.success(backend, time.monotonic() - start)
+		metrics.ai_call(backend, "txt2img", time.monotonic() - start, prompt=prompt, phase="sd")
+		imgs = data.get("images", [])
+		if not imgs:
+			return None
+		# images are base64 data URLs; keep the first
+		import base64
+		b64 = imgs[0]
+		if "," in b64:
+			b64 = b64.split(",", 1)[1]
+		return base64.b64decode(b64)
+
+	@metrics.operation("_sd_txt2img")
+	def _sd_txt2img(self, prompt: str) -> str | None:
+		binary = None
+		# If a ComfyUI base URL is configured, try to use it first. Many
+		# ComfyUI HTTP plugins expose an Automatic1111-compatible /sdapi/v1/txt2img
+		# endpoint or a similar endpoint; apps can set COMFYUI_BASE_URL to point
+		# to such a server. If that fails, fall back to SD_BASE_URL.
+		if self.comfy_base and self.comfy_base != self.sd_base:
+			try:
+				binary = self._txt2img_request("comfyui", self.comfy_base, prompt)
+			except Exception as e:
+				print(f"ComfyUI image generation failed: {e}")
+			if binary is None:
+				metrics.fallback("sd")
+		try:
+			if binary is None:
+				binary = self._txt2img_request("sd", self.sd_base, prompt)
+			if binary is None:
 				print("No images returned from Stable Diffusion")
 				return None
-			# images are base64 data URLs; save the first
-			import base64
-			b64 = imgs[0]
-			if "," in b64:
-				b64 = b64.split(",", 1)[1]
-			binary = base64.b64decode(b64)
-			filename = f"{name_hint}.png".replace("/", "_")
-			path = os.path.join(out_dir, filename)
-			with open(path, "wb") as f:
-				f.write(binary)
 			# return web path under /static
-			return "/static/generated/" + filename
+			return image_store.put(binary, "png")
 		except Exception as e:
 			print(f"Stable Diffusion image generation failed: {e}")
 			return None
 
-	def _gemini_generate_image(self, prompt: str, out_dir: str, name_hint: str) -> str | None:
+	def _gemini_generate_image(self, prompt: str) -> str | None:
 		"""Generate image using Gemini's image generation capabilities"""
 		# Note: Gemini image generation is currently not working due to API limitations
 		# and quota restrictions. This will be implemented when the API becomes more stable.
@@ -231,6 +196,7 @@ class AIService:
 		print("Gemini image generation is currently disabled due to API limitations")
 		return None
 
+	@metrics.operation("extract_main_characters")
 	def extract_main_characters(self, book_title: str) -> List[str]:
 		prompt1 = (
 			f"You are a literary assistant. List the five main characters from the book '{book_title}'. "
@@ -240,28 +206,12 @@ class AIService:
 			f"List five main characters from '{book_title}' as a JSON array of strings only."
 		)
 		texts: List[str] = []
-		if self.provider == "ollama":
-			texts.append(self._ollama_generate(prompt1))
-			if not texts[-1] or len(self._filter_names(self._parse_names(texts[-1]), book_title)) < 5:
-				texts.append(self._ollama_generate(prompt2))
-		elif self.provider == "gemini":
-			texts.append(self._gemini_generate(prompt1))
+		if self.backend:
+			texts.append(self._generate(prompt1, max_tokens=128))
 			if not texts[-1] or len(self._filter_names(self._parse_names(texts[-1]), book_title)) < 5:
-				texts.append(self._gemini_generate(prompt2))
-		elif self.client:
-			resp = self.client.chat.completions.create(
-				model="gpt-4o-mini",
-				messages=[{"role": "user", "content": prompt1}],
-				max_tokens=128,
-			)
-			texts.append(resp.choices[0].message.content.strip())
-			if len(self._filter_names(self._parse_names(texts[-1]), book_title)) < 5:
-				resp2 = self.client.chat.completions.create(
-					model="gpt-4o-mini",
-					messages=[{"role": "user", "content": prompt2}],
-					max_tokens=128,
-				)
-				texts.append(resp2.choices[0].message.content.strip())
+				metrics.parse_failure()
+				metrics.fallback("json_prompt")
+				texts.append(self._generate(prompt2, max_tokens=128))
 		names: List[str] = []
 		for t in texts:
 			cand = self._filter_names(self._parse_names(t), book_title)
@@ -271,59 +221,54 @@ class AIService:
 			elif not names:
 				names = cand
 		# Ensure exactly 5
-		fallback = [
+		fallback = self.fallback_characters(book_title)
+		if len(names) < 5:
+			metrics.stub_content()
+		names = (names + [n for n in fallback if n not in names])[:5]
+		return [n if n else "Character" for n in names[:5]]
+
+	def fallback_characters(self, book_title: str) -> List[str]:
+		return [
 			f"{book_title} Protagonist",
 			"Best Friend",
 			"Detective",
 			"Antagonist",
 			"Witness",
 		]
-		names = (names + [n for n in fallback if n not in names])[:5]
-		return [n if n else "Character" for n in names[:5]]
 
-	def generate_chapter(self, book_title: str, character: str, chapter_num: int, history: List[Tuple[int, str, str]]):
-		history_text = "\n".join(
-			f"Chapter {n}: {summary} | Choice {choice}" for n, summary, choice in history
-		)
-		prompt = (
+	def _story_preamble(self, book_title: str, character: str) -> str:
+		# Identical for every chapter of a story, so it leads the prompt where the
+		# model server's prompt cache can reuse it
+		return (
 			f"We're writing a branching adventure for '{book_title}'. Player is '{character}'.\n"
-			f"We are at Chapter {chapter_num}. Prior chapters and choices: \n{history_text}\n"
-			"Write the next chapter (150-250 words) immersive 2nd-person. Do NOT include a heading like 'Chapter N:'. End with three distinct numbered options."
+			"Each chapter is 150-250 words, immersive 2nd-person. Do NOT include a heading like 'Chapter N:'. End with three distinct numbered options.\n"
+		)
+
+	def _chapter_prompt(self, book_title: str, character: str, chapter_num: int, history: List[Tuple[int, str, str]], summary: str | None = None, facts: List[str] | None = None) -> str:
+		# A rolling summary replaces the per-chapter history when the caller keeps one
+		if summary is None:
+			summary = "\n".join(
+				f"Chapter {n}: {snippet} | Choice {choice}" for n, snippet, choice in history
+			)
+		facts_text = f"Key decisions so far: {'; '.join(facts)}\n" if facts else ""
+		return (
+			self._story_preamble(book_title, character)
+			+ f"Prior chapters and choices: \n{summary}\n"
+			+ facts_text
+			+ f"Write Chapter {chapter_num}."
+		)
+
+	def _continuation_prompt(self, chapter_num: int, choice: str | None) -> str:
+		"""Short prompt appended to a reused KV context, which already holds the previous chapter."""
+		if choice not in ("A", "B", "C"):
+			raise ValueError(f"Continuing chapter {chapter_num - 1} needs the reader's choice (A, B or C), got {choice!r}")
+		option = "ABC".index(choice) + 1
+		return (
+			f"The reader picks option {option}. Write Chapter {chapter_num} the same way: "
+			"150-250 words, 2nd-person, no heading, ending with three distinct numbered options."
 		)
-		if self.provider == "ollama":
-			text = self._ollama_generate(prompt)
-			if not text:
-				content = (
-					f"Chapter {chapter_num}: {character} ventures deeper into '{book_title}'. "
-					f"A challenge appears based on prior choice {history[-1][2] if history else 'N/A'}."
-				)
-				choices = ["Go left into the mist", "Confront the guardian", "Retreat and plan"]
-				return content, choices, None
-		elif self.provider == "gemini":
-			text = self._gemini_generate(prompt)
-			if not text:
-				content = (
-					f"Chapter {chapter_num}: {character} ventures deeper into '{book_title}'. "
-					f"A challenge appears based on prior choice {history[-1][2] if history else 'N/A'}."
-				)
-				choices = ["Go left into the mist", "Confront the guardian", "Retreat and plan"]
-				return content, choices, None
-		else:
-			if self.client:
-				resp = self.client.chat.completions.create(
-					model="gpt-4o-mini",
-					messages=[{"role": "user", "content": prompt}],
-					max_tokens=600,
-				)
-				text = resp.choices[0].message.content.strip()
-			else:
-				content = (
-					f"Chapter {chapter_num}: {character} ventures deeper into '{book_title}'. "
-					f"A challenge appears based on prior choice {history[-1][2] if history else 'N/A'}."
-				)
-				choices = ["Go left into the mist", "Confront the guardian", "Retreat and plan"]
-				return content, choices, None
 
+	def _parse_chapter(self, text: str) -> Tuple[str, List[str]]:
 		lines = [l.strip() for l in text.splitlines() if l.strip()]
 		# remove any model-added chapter heading to avoid mismatch with our UI number
 		if lines and re.match(r'^chapter\s*\d+\s*[:\-]', lines[0], re.IGNORECASE):
@@ -343,17 +288,132 @@ class AIService:
 				break
 			content_lines.append(l)
 		content = "\n".join(content_lines).strip()
+		return content, choices
+
+	@metrics.operation("generate_chapter")
+	def generate_chapter(self, book_title: str, character: str, chapter_num: int, history: List[Tuple[int, str, str]], with_image: bool = True, summary: str | None = None, facts: List[str] | None = None, llm_context: Tuple[str, List[int]] | None = None, choice: str | None = None) -> ChapterDraft:
+		text, new_context = "", None
+		context = self._reusable_context(llm_context)
+		prompt = self._chapter_prompt(book_title, character, chapter_num, history, summary, facts)
+		if self.backend and Config.HEDGE_REQUESTS:
+			# The continuation and the full prompt on every target all take part in one race
+			continuation = self._continuation_prompt(chapter_num, choice) if context else None
+			text, new_context = self._hedged_generate(prompt, continuation, context)
+		else:
+			if context:
+				text, new_context = self.backend.generate_with_context(self._continuation_prompt(chapter_num, choice), context)
+			if not text:
+				# No usable context (or the continuation failed): send the full prompt
+				if self.keeps_context:
+					text, new_context = self.backend.generate_with_context(prompt)
+				else:
+					text = self._generate(prompt)
+		draft = self.complete_chapter(text, book_title, character, chapter_num, history, with_image=with_image)
+		return draft._replace(llm_context=new_context)
+
+	def _valid_chapter(self, text: str) -> bool:
+		"""Whether raw model output parses into a story plus three options of its own."""
+		if not text.strip():
+			return False
+		content, choices = self._parse_chapter(text)
+		# _parse_chapter pads missing options with these placeholders
+		return bool(content) and not {"Option A", "Option B", "Option C"} & set(choices)
+
+	def _attempts(self, backend, prompt: str, context: Tuple[str, List[int]] | None = None) -> list:
+		if hasattr(backend, "attempts"):
+			return backend.attempts(prompt, context)
+		if context:
+			return []
+		# Providers without cancellable attempts just run to completion if they lose
+		return [(backend.name, lambda cancelled: (backend.generate(prompt, max_tokens=600), None))]
+
+	def _hedged_generate(self, prompt: str, continuation: str | None = None, context: Tuple[str, List[int]] | None = None) -> Tuple[str, Tuple[str, List[int]] | None]:
+		"""Race the primary backend against hedge targets; return the winning text and its KV context."""
+		from . import hedging
 
+		attempts = []
+		if context:
+			# The cheap continuation goes first; full prompts hedge it
+			attempts += self._attempts(self.backend, continuation, context)
+		for backend in [self.backend, *self.hedge_backends]:
+			attempts += self._attempts(backend, prompt)
+		won = hedging.first_valid(
+			attempts,
+			lambda result: self._valid_chapter(result[0]),
+			latency=lambda label: self.health.latency_percentile(label, Config.HEDGE_PERCENTILE),
+		)
+		if not won:
+			return "", None
+		text, new_context = won[1]
+		return text, (new_context if self.keeps_context else None)
+
+	@metrics.operation("stream_chapter")
+	def stream_chapter(self, book_title: str, character: str, chapter_num: int, history: List[Tuple[int, str, str]], summary: str | None = None, facts: List[str] | None = None, llm_context: Tuple[str, List[int]] | None = None, choice: str | None = None, result: dict | None = None):
+		"""Yield raw chapter text as the provider produces it.
+
+		Pass the concatenated chunks to ``complete_chapter`` once exhausted to
+		get the parsed content, choices and image. With a context-keeping
+		backend the new KV context is left in ``result["context"]``.
+		"""
+		if not self.backend:
+			return
+		prompt = self._chapter_prompt(book_title, character, chapter_num, history, summary, facts)
+		if not self.keeps_context:
+			yield from self.backend.stream(prompt)
+			return
+		context = self._reusable_context(llm_context)
+		if context:
+			produced = False
+			for chunk in self.backend.stream(self._continuation_prompt(chapter_num, choice), context=context, result=result):
+				produced = True
+				yield chunk
+			if produced:
+				return
+		yield from self.backend.stream(prompt, result=result)
+
+	@metrics.operation("complete_chapter")
+	def complete_chapter(self, text: str, book_title: str, character: str, chapter_num: int, history: List[Tuple[int, str, str]], with_image: bool = True) -> ChapterDraft:
+		"""Turn raw model output into a ``ChapterDraft``, or stub content if empty.
+
+		With ``with_image=False`` the image is left to the caller (see
+		``generate_chapter_image``) and ``image_url`` is None.
+		"""
+		text = (text or "").strip()
+		if not text:
+			metrics.stub_content()
+			content = (
+				f"Chapter {chapter_num}: {character} ventures deeper into '{book_title}'. "
+				f"A challenge appears based on prior choice {history[-1][2] if history else 'N/A'}."
+			)
+			choices = ["Go left into the mist", "Confront the guardian", "Retreat and plan"]
+			return ChapterDraft(content, choices, None, stub=True)
+
+		if not self._valid_chapter(text):
+			metrics.parse_failure()
+		content, choices = self._parse_chapter(text)
+		image_url = self.generate_chapter_image(book_title, character, chapter_num) if with_image else None
+		return ChapterDraft(content, choices, image_url)
+
+	@metrics.operation("generate_chapter_image")
+	def generate_chapter_image(self, book_title: str, character: str, chapter_num: int) -> str | None:
 		visual_prompt = f"illustration, {book_title}, chapter {chapter_num}, protagonist {character}; atmospheric, cinematic lighting"
-		static_dir = os.path.join(os.path.dirname(__file__), "static", "generated")
-		
+
+		# An identical render request reuses the stored image without calling SD
+		key = image_store.request_key(self._txt2img_params(visual_prompt))
+		image_url = image_store.lookup(key)
+		if image_url:
+			return image_url
+
 		# Try Gemini image generation first, then fall back to Stable Diffusion
-		image_url = None
 		if self.provider == "gemini":
-			image_url = self._gemini_generate_image(visual_prompt, static_dir, f"chapter_{chapter_num}_{character.replace(' ', '_')}")
+			image_url = self._gemini_generate_image(visual_prompt)
 		
 		# If Gemini image generation failed, try Stable Diffusion as fallback
 		if not image_url:
-			image_url = self._sd_txt2img(visual_prompt, static_dir, f"chapter_{chapter_num}_{character.replace(' ', '_')}")
-		
-		return content, choices, image_url
+			if self.provider == "gemini":
+				metrics.fallback("sd")
+			image_url = self._sd_txt2img(visual_prompt)
+
+		if image_url:
+			image_store.remember(key, image_url)
+		return image_url
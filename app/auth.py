@@ -1,9 +1,6 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import check_password_hash, generate_password_hash
-from flask_dance.contrib.google import google
-from flask_dance.contrib.github import github
-from flask_dance.contrib.discord import discord
 from werkzeug.routing import BuildError
 from . import db
 from .models import User
@@ -108,6 +105,7 @@ def login_discord():
 
 @auth_bp.get("/oauth/google/finalize")
 def oauth_finalize_google():
+    from flask_dance.contrib.google import google
     if not google.authorized:
         flash("Google auth not authorized", "danger")
         return redirect(url_for("auth.login_page"))
@@ -141,6 +139,7 @@ def oauth_finalize_google():
 
 @auth_bp.get("/oauth/github/finalize")
 def oauth_finalize_github():
+    from flask_dance.contrib.github import github
     if not github.authorized:
         flash("GitHub auth not authorized", "danger")
         return redirect(url_for("auth.login_page"))
@@ -187,6 +186,7 @@ def oauth_finalize_github():
 
 @auth_bp.get("/oauth/discord/finalize")
 def oauth_finalize_discord():
+    from flask_dance.contrib.discord import discord
     if not discord.authorized:
         flash("Discord auth not authorized", "danger")
         return redirect(url_for("auth.login_page"))
@@ -0,0 +1,90 @@
+"""Cache of extracted main characters, keyed by normalized book title.
+
+Lookups go through a small in-process LRU first, then the
+``character_cache`` table, and only call the AI backend on a miss.
+"""
+import json
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import List
+
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .models import CharacterCache
+from .story import ai_service
+from config import Config
+
+_lru: "OrderedDict[tuple[str, str, str], tuple[List[str], datetime]]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def normalize_title(book_title: str) -> str:
+    """Fold case, accents, punctuation and a leading article so equivalent titles share a key."""
+    text = unicodedata.normalize("NFKD", book_title or "")
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).casefold()
+    text = re.sub(r"[^\w\s]", " ", text)
+    text = re.sub(r"\s+", " ", text).strip()
+    text = re.sub(r"^(the|a|an) ", "", text)
+    return text[:255]
+
+
+def _lru_get(key: tuple[str, str, str], now: datetime) -> List[str] | None:
+    with _lock:
+        hit = _lru.get(key)
+        if hit is None:
+            return None
+        names, stored_at = hit
+        if now - stored_at > timedelta(seconds=Config.CHARACTER_CACHE_TTL):
+            del _lru[key]
+            return None
+        _lru.move_to_end(key)
+        return list(names)
+
+
+def _lru_put(key: tuple[str, str, str], names: List[str], stored_at: datetime) -> None:
+    with _lock:
+        _lru[key] = (list(names), stored_at)
+        _lru.move_to_end(key)
+        while len(_lru) > Config.CHARACTER_CACHE_LRU_SIZE:
+            _lru.popitem(last=False)
+
+
+def is_placeholder(book_title: str, names: List[str]) -> bool:
+    """Whether ``names`` is the built-in list returned when the backend produced nothing usable."""
+    return set(names) <= set(ai_service.fallback_characters(book_title)) | {"Character"}
+
+
+def get_characters(book_title: str) -> List[str]:
+    """Return the five main characters for ``book_title``, calling the AI backend only on a miss."""
+    key = (normalize_title(book_title), ai_service.provider, ai_service.model_label)
+    now = datetime.utcnow()
+    names = _lru_get(key, now)
+    if names is not None:
+        return names
+
+    row = CharacterCache.query.filter_by(title_key=key[0], provider=key[1], model=key[2]).first()
+    if row and now - row.created_at <= timedelta(seconds=Config.CHARACTER_CACHE_TTL):
+        names = json.loads(row.characters)
+        _lru_put(key, names, row.created_at)
+        return names
+
+    names = ai_service.extract_main_characters(book_title)
+    # Don't pin the placeholder list when the backend produced nothing usable
+    if is_placeholder(book_title, names):
+        return names
+    if row:
+        row.characters = json.dumps(names)
+        row.created_at = now
+    else:
+        db.session.add(CharacterCache(title_key=key[0], provider=key[1], model=key[2], characters=json.dumps(names), created_at=now))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another worker stored the same title first; theirs is just as good
+        db.session.rollback()
+    _lru_put(key, names, now)
+    return names
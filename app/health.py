@@ -0,0 +1,186 @@
+"""Health tracking and circuit breakers for AI backends.
+
+Every Ollama model and every image backend gets a ``CircuitBreaker`` that
+keeps a rolling window of call outcomes and an EWMA of successful-call
+latency. It also keeps the recent latencies themselves; hedging uses a
+percentile of them as its delay. When the error rate in the window crosses
+the threshold the breaker opens and callers skip that target immediately
+instead of waiting out its timeout. After a cooldown a background prober (or a single live trial call in
+the half-open state) decides whether to close it again.
+"""
+import threading
+import time
+from collections import deque
+from typing import Callable
+
+import requests
+
+from config import Config
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.latency_ewma: float | None = None
+        self.total_calls = 0
+        self.total_failures = 0
+        self.last_error: str | None = None
+        self._outcomes: deque[bool] = deque(maxlen=Config.BREAKER_WINDOW)
+        self._latencies: deque[float] = deque(maxlen=Config.BREAKER_WINDOW)
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Return True if a call may go to this target now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < Config.BREAKER_COOLDOWN_SECONDS:
+                    return False
+                self.state = HALF_OPEN
+            # Half-open: let exactly one trial call through
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def available(self) -> bool:
+        """Like ``allow`` but without reserving the half-open trial; used for host-level breakers."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= Config.BREAKER_COOLDOWN_SECONDS:
+                self.state = HALF_OPEN
+            return self.state != OPEN
+
+    def release(self) -> None:
+        """Give back a half-open trial without an outcome: the call was abandoned, not answered."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record(self, ok: bool, latency: float | None = None, error: str | None = None) -> None:
+        with self._lock:
+            self.total_calls += 1
+            self._trial_in_flight = False
+            if ok:
+                if latency is not None:
+                    alpha = Config.LATENCY_EWMA_ALPHA
+                    self.latency_ewma = latency if self.latency_ewma is None else alpha * latency + (1 - alpha) * self.latency_ewma
+                    self._latencies.append(latency)
+                if self.state != CLOSED:
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                self._outcomes.append(True)
+                return
+            self.total_failures += 1
+            self.last_error = (error or "")[:200] or None
+            self._outcomes.append(False)
+            if self.state == HALF_OPEN or self._should_open():
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def _should_open(self) -> bool:
+        calls = len(self._outcomes)
+        if calls < Config.BREAKER_MIN_CALLS:
+            return False
+        return self.error_rate() >= Config.BREAKER_ERROR_RATE
+
+    def latency_percentile(self, percentile: float) -> float | None:
+        """Latency of successful calls in the window at ``percentile``, or None with fewer than BREAKER_MIN_CALLS."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies or len(latencies) < Config.BREAKER_MIN_CALLS:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+    def error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    def snapshot(self, include_errors: bool = False) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "error_rate": round(self.error_rate(), 3),
+                "window": len(self._outcomes),
+                "latency_ewma": round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+                "total_calls": self.total_calls,
+                "total_failures": self.total_failures,
+                # Error text can carry internal URLs and hostnames
+                "last_error": self.last_error if include_errors else None,
+                "open_for": round(time.monotonic() - self.opened_at, 1) if self.state != CLOSED else None,
+            }
+
+
+class HealthRegistry:
+    """Named breakers plus a background thread that probes the open ones."""
+
+    def __init__(self):
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._probes: dict[str, Callable[[], bool]] = {}
+        self._lock = threading.Lock()
+        self._prober: threading.Thread | None = None
+
+    def breaker(self, name: str) -> CircuitBreaker:
+        with self._lock:
+            br = self._breakers.get(name)
+            if br is None:
+                br = self._breakers[name] = CircuitBreaker(name)
+            return br
+
+    def latency_percentile(self, name: str, percentile: float) -> float | None:
+        """``CircuitBreaker.latency_percentile`` for ``name``; None for targets without a breaker."""
+        with self._lock:
+            br = self._breakers.get(name)
+        return br.latency_percentile(percentile) if br else None
+
+    def set_probe(self, name: str, probe: Callable[[], bool]) -> None:
+        with self._lock:
+            self._probes[name] = probe
+
+    def success(self, name: str, latency: float, backend: str | None = None) -> None:
+        self.breaker(name).record(True, latency=latency)
+        if backend:
+            self.breaker(backend).record(True)
+
+    def failure(self, name: str, error: Exception, backend: str | None = None) -> None:
+        """Record a failed call; only connection errors and timeouts count against ``backend``."""
+        self.breaker(name).record(False, error=str(error))
+        if backend:
+            down = isinstance(error, (requests.ConnectionError, requests.Timeout))
+            self.breaker(backend).record(not down, error=str(error) if down else None)
+        self._ensure_prober()
+
+    def snapshot(self, include_errors: bool = False) -> dict:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {br.name: br.snapshot(include_errors) for br in breakers}
+
+    def _ensure_prober(self) -> None:
+        with self._lock:
+            if self._prober is not None and self._prober.is_alive():
+                return
+            self._prober = threading.Thread(target=self._probe_loop, name="backend-prober", daemon=True)
+            self._prober.start()
+
+    def _probe_loop(self) -> None:
+        while True:
+            time.sleep(Config.HEALTH_PROBE_INTERVAL)
+            with self._lock:
+                targets = [(br, self._probes.get(name)) for name, br in self._breakers.items()]
+            for br, probe in targets:
+                if probe is None or br.state == CLOSED or not br.allow():
+                    continue
+                try:
+                    ok = bool(probe())
+                except Exception as e:
+                    br.record(False, error=f"probe: {e}")
+                    continue
+                # Probe latency says nothing about real generation latency, so leave the EWMA alone
+                br.record(ok, error=None if ok else "probe failed")
@@ -0,0 +1,133 @@
+"""Hedged requests: several backends race and the first good response wins.
+
+``first_valid`` starts the first attempt. When the newest attempt has run
+longer than its target usually takes (``latency``, else ``HEDGE_DELAY_MS``)
+without a valid result, or as soon as an attempt fails, it starts the next
+one. The clock starts when an attempt gets a thread, not while it is queued,
+and two attempts at the same target (label) never run at once: a second
+copy of the prompt on a busy server only slows both down. The first result
+that passes ``validate`` is returned and the rest are cancelled.
+
+Attempts are blocking callables (the HTTP transport is synchronous), run on
+a small thread pool and awaited from a private asyncio event loop. Each one
+receives a ``threading.Event`` that is set when it loses, so it can close its
+connection and stop the server generating.
+"""
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Tuple
+
+from . import metrics
+from config import Config
+
+# (label, fn(cancelled) -> result)
+Attempt = Tuple[str, Callable[[threading.Event], Any]]
+
+_executor = ThreadPoolExecutor(max_workers=Config.OLLAMA_POOL_SIZE, thread_name_prefix="hedge")
+
+
+async def _race(attempts: List[Attempt], validate: Callable[[Any], bool], delay: Callable[[str], float]) -> Tuple[str, Any] | None:
+    loop = asyncio.get_running_loop()
+    queue = list(attempts)
+    pending: dict[asyncio.Future, Tuple[str, threading.Event]] = {}
+    fallback = None
+    # The newest attempt: its number, label and when it started running (None while queued)
+    newest: dict = {"n": 0, "label": None, "started": None}
+    started = asyncio.Event()
+    waiter: asyncio.Future | None = None
+
+    def ready() -> Attempt | None:
+        running = {label for label, _ in pending.values()}
+        return next((attempt for attempt in queue if attempt[0] not in running), None)
+
+    def on_start(n: int) -> None:
+        if n == newest["n"]:
+            newest["started"] = loop.time()
+            started.set()
+
+    def launch(attempt: Attempt) -> None:
+        if newest["n"]:
+            metrics.fallback("hedge")
+        queue.remove(attempt)
+        label, fn = attempt
+        newest.update(n=newest["n"] + 1, label=label, started=None)
+        started.clear()
+        cancelled = threading.Event()
+        # Run in a copy of this context so backend calls keep their metrics labels
+        context = contextvars.copy_context()
+
+        def run(n: int = newest["n"]) -> Any:
+            loop.call_soon_threadsafe(on_start, n)
+            return context.run(fn, cancelled)
+
+        pending[loop.run_in_executor(_executor, run)] = (label, cancelled)
+
+    launch(queue[0])
+    try:
+        while pending:
+            watch: set = set(pending)
+            timeout = None
+            if ready():
+                if newest["started"] is None:
+                    # Still queued for a thread: the hedge clock has not started
+                    waiter = waiter or asyncio.ensure_future(started.wait())
+                    watch.add(waiter)
+                else:
+                    timeout = max(0.0, newest["started"] + delay(newest["label"]) - loop.time())
+            done, _ = await asyncio.wait(watch, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if waiter in done:
+                done.discard(waiter)
+                waiter = None
+                if not done:
+                    continue
+            for future in done:
+                label, _ = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Hedged attempt {label} failed: {e}")
+                    continue
+                if validate(result):
+                    return label, result
+                fallback = fallback or (label, result)
+            # Slow or failed so far: put the next target in flight
+            attempt = ready()
+            if attempt:
+                launch(attempt)
+        return fallback
+    finally:
+        if waiter:
+            waiter.cancel()
+        for future, (label, cancelled) in pending.items():
+            cancelled.set()
+            future.cancel()
+
+
+def first_valid(
+    attempts: List[Attempt],
+    validate: Callable[[Any], bool],
+    latency: Callable[[str], float | None] | None = None,
+) -> Tuple[str, Any] | None:
+    """Race ``attempts`` and return ``(label, result)`` of the winner.
+
+    Only attempts at the first ``HEDGE_MAX_ATTEMPTS`` targets are kept; a
+    target's later attempts (a full prompt after a KV-context continuation)
+    run only if its earlier one fails.
+
+    ``latency(label)`` gives the observed latency (seconds) after which an
+    attempt at that target is hedged, or None to use ``HEDGE_DELAY_MS``.
+    Returns the first result that passes ``validate``. If none does, returns
+    the first result that came back at all, or None if every attempt raised.
+    """
+    targets = list(dict.fromkeys(label for label, _ in attempts))[:max(1, Config.HEDGE_MAX_ATTEMPTS)]
+    attempts = [attempt for attempt in attempts if attempt[0] in targets]
+    if not attempts:
+        return None
+
+    def delay(label: str) -> float:
+        observed = latency(label) if latency else None
+        return observed if observed is not None else Config.HEDGE_DELAY_MS / 1000
+
+    return asyncio.run(_race(attempts, validate, delay))
@@ -0,0 +1,170 @@
+"""Content-addressed store for generated images.
+
+Files are named by the SHA-256 of their bytes and sharded two levels deep
+(``static/generated/ab/cd/abcd....png``, or under ``IMAGE_STORE_DIR``; the
+URL is ``/static/generated/...`` either way), so identical images share one file
+and concurrent writers can never clobber each other. The ``image_index``
+table maps a hash of the render request (prompt and SD parameters) to the
+stored image, letting an identical prompt skip Stable Diffusion entirely.
+
+When Pillow is installed, compressed WebP (or AVIF) copies at a few widths
+are written beside each original as ``<hash>-<width>w.<format>`` for
+``srcset`` and thumbnails.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from typing import Callable, List
+
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .models import ImageIndex
+from config import Config
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
+STORE_DIR = Config.IMAGE_STORE_DIR or os.path.join(STATIC_DIR, "generated")
+STORE_URL = "/static/generated/"
+
+
+def request_key(params: dict) -> str:
+    """Stable hash of a render request; parameters are serialized with sorted keys."""
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _path_for(digest: str, ext: str) -> str:
+    return os.path.join(STORE_DIR, digest[:2], digest[2:4], f"{digest}.{ext}")
+
+
+def _url_for(path: str) -> str:
+    return STORE_URL + os.path.relpath(path, STORE_DIR).replace(os.sep, "/")
+
+
+def _path_from_url(url: str) -> str:
+    if url.startswith(STORE_URL):
+        return os.path.join(STORE_DIR, *url[len(STORE_URL):].split("/"))
+    return os.path.join(STATIC_DIR, *url[len("/static/"):].split("/"))
+
+
+def init_app(app) -> None:
+    """Serve ``STORE_DIR`` at ``STORE_URL`` when it lies outside the static folder."""
+    from flask import send_from_directory
+
+    if os.path.abspath(STORE_DIR) == os.path.join(os.path.abspath(STATIC_DIR), "generated"):
+        return
+    app.add_url_rule(
+        STORE_URL + "<path:filename>",
+        "generated_image",
+        lambda filename: send_from_directory(STORE_DIR, filename),
+    )
+
+
+def _atomic_write(path: str, write: Callable) -> None:
+    # Write to a temp file in the same directory, then rename into place atomically
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _variant_widths() -> List[int]:
+    return sorted({*Config.IMAGE_VARIANT_WIDTHS, Config.IMAGE_THUMB_WIDTH})
+
+
+def _variant_path(path: str, width: int, fmt: str) -> str:
+    return f"{os.path.splitext(path)[0]}-{width}w.{fmt}"
+
+
+def _variant_formats() -> List[str]:
+    # AVIF needs a Pillow build with libavif; WebP is the fallback
+    return list(dict.fromkeys([Config.IMAGE_VARIANT_FORMAT, "webp"]))
+
+
+def _write_variants(path: str) -> None:
+    """Encode the downscaled copies of the original at ``path`` that are missing."""
+    # Pillow is optional and only imported by image workers; without it originals are served as-is
+    try:
+        from PIL import Image
+    except ImportError:
+        return
+    with Image.open(path) as original:
+        original.load()
+        for fmt in _variant_formats():
+            try:
+                for width in _variant_widths():
+                    target = _variant_path(path, width, fmt)
+                    if width > original.width or os.path.exists(target):
+                        continue
+                    img = original
+                    if width < original.width:
+                        img = original.resize((width, round(original.height * width / original.width)), Image.LANCZOS)
+                    _atomic_write(target, lambda f: img.save(f, fmt.upper(), quality=Config.IMAGE_VARIANT_QUALITY))
+                return
+            except (KeyError, OSError) as e:
+                print(f"Encoding {fmt} variants of {path} failed: {e}")
+
+
+def put(data: bytes, ext: str = "png") -> str:
+    """Store ``data`` under its content hash and return its URL under /static."""
+    path = _path_for(hashlib.sha256(data).hexdigest(), ext)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _atomic_write(path, lambda f: f.write(data))
+    if Config.IMAGE_VARIANTS:
+        try:
+            _write_variants(path)
+        except Exception as e:
+            print(f"Image variants for {path} failed: {e}")
+    return _url_for(path)
+
+
+def variants(url: str | None) -> dict:
+    """Responsive sources for ``url``: ``srcset``/``type`` of the stored variants and a ``thumb`` URL.
+
+    Images without variants (no Pillow, uploads, older files) get an empty
+    ``srcset`` and the original as ``thumb``.
+    """
+    result = {"srcset": "", "type": None, "thumb": url}
+    if not url or not url.startswith("/static/"):
+        return result
+    path = _path_from_url(url)
+    for fmt in _variant_formats():
+        found = [(w, _variant_path(path, w, fmt)) for w in _variant_widths()]
+        found = [(w, p) for w, p in found if os.path.exists(p)]
+        if not found:
+            continue
+        result["srcset"] = ", ".join(f"{_url_for(p)} {w}w" for w, p in found)
+        result["type"] = f"image/{fmt}"
+        thumb = dict(found).get(Config.IMAGE_THUMB_WIDTH)
+        if thumb:
+            result["thumb"] = _url_for(thumb)
+        break
+    return result
+
+
+def lookup(key: str) -> str | None:
+    """Return the stored image URL for request ``key`` if its file still exists."""
+    row = ImageIndex.query.filter_by(request_hash=key).first()
+    if row and os.path.exists(_path_from_url(row.url)):
+        return row.url
+    return None
+
+
+def remember(key: str, url: str) -> None:
+    """Record that request ``key`` rendered to ``url``."""
+    row = ImageIndex.query.filter_by(request_hash=key).first()
+    if row:
+        # The indexed file went missing and was rendered again
+        row.url = url
+    else:
+        db.session.add(ImageIndex(request_hash=key, url=url))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another worker rendered the same prompt first; both files are valid
+        db.session.rollback()
@@ -0,0 +1,78 @@
+"""Asynchronous chapter illustrations.
+
+Chapters are saved with ``image_status="pending"`` and shown straight away;
+a small thread pool renders the image and fills in ``Chapter.image_url``.
+The chapter page polls ``status()`` to swap the image in when it is ready.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import Flask
+from sqlalchemy.orm.exc import StaleDataError
+
+from . import db
+from .image_store import variants
+from .models import Chapter
+from .story import ai_service
+from config import Config
+
+_executor = ThreadPoolExecutor(max_workers=Config.IMAGE_WORKERS, thread_name_prefix="chapter-image")
+_inflight: set[int] = set()
+_lock = threading.Lock()
+
+
+def enqueue(app: Flask, chapter_id: int) -> None:
+    with _lock:
+        if chapter_id in _inflight:
+            return
+        _inflight.add(chapter_id)
+    _executor.submit(_run, app, chapter_id)
+
+
+def _run(app: Flask, chapter_id: int) -> None:
+    try:
+        with app.app_context():
+            chapter = db.session.get(Chapter, chapter_id)
+            if not chapter or chapter.image_status != "pending":
+                return
+            session_obj = chapter.session
+            key = (chapter.session_id, chapter.number, chapter.created_at)
+            try:
+                image_url = ai_service.generate_chapter_image(
+                    session_obj.book_title, session_obj.selected_character or "Protagonist", chapter.number
+                )
+            except Exception as e:
+                print(f"Image for chapter {chapter_id} failed: {e}")
+                image_url = None
+            # The chapter may have been deleted (Back / Delete Story) meanwhile. End the
+            # read transaction and reload, or the identity map hands back the old row
+            db.session.rollback()
+            chapter = db.session.get(Chapter, chapter_id, populate_existing=True)
+            # SQLite can give a replacement chapter the deleted row's id
+            if not chapter or (chapter.session_id, chapter.number, chapter.created_at) != key:
+                return
+            chapter.image_url = image_url
+            chapter.image_status = "ready" if image_url else "failed"
+            try:
+                db.session.commit()
+            except StaleDataError:
+                # Deleted between the reload and the update
+                db.session.rollback()
+    finally:
+        with _lock:
+            _inflight.discard(chapter_id)
+
+
+def status(app: Flask, chapter: Chapter) -> dict:
+    """Report the image state of ``chapter``; pending images orphaned by a dead worker are re-queued."""
+    if chapter.image_status == "pending":
+        with _lock:
+            running_here = chapter.id in _inflight
+        if not running_here and datetime.utcnow() - chapter.created_at > timedelta(seconds=Config.IMAGE_TIMEOUT_SECONDS):
+            enqueue(app, chapter.id)
+    return {
+        "status": chapter.image_status or ("ready" if chapter.image_url else "none"),
+        "image_url": chapter.image_url,
+        "srcset": variants(chapter.image_url)["srcset"],
+    }
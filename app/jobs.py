@@ -0,0 +1,182 @@
+"""Background chapter generation backed by the ``generation_job`` table.
+
+Requests enqueue a job and return immediately; a bounded thread pool in each
+worker process claims queued rows and writes the resulting ``Chapter``. The
+chapter page polls ``status()`` until the chapter exists. Deleting a story
+or going back cancels its jobs; a job that is already generating checks
+before saving and drops its chapter.
+
+Each process refreshes ``heartbeat_at`` on the jobs it holds every
+``JOB_HEARTBEAT_SECONDS``. A job whose process has missed three heartbeats
+(the process died or was restarted) is re-queued on the next status poll.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import Flask
+from sqlalchemy.orm.exc import ObjectDeletedError
+
+from . import db, prefetch
+from .models import Chapter, GenerationJob, StorySession
+from .story import GenerationCancelled
+from config import Config
+
+ACTIVE = ("queued", "running")
+
+_executor = ThreadPoolExecutor(max_workers=Config.JOB_WORKERS, thread_name_prefix="chapter-job")
+# Ids of the jobs queued or running in this process
+_held: set[int] = set()
+_held_lock = threading.Lock()
+_heartbeat: threading.Thread | None = None
+
+
+def _is_stale(job: GenerationJob, now: datetime) -> bool:
+    beat = job.heartbeat_at or job.started_at or job.created_at
+    if now - beat > timedelta(seconds=3 * Config.JOB_HEARTBEAT_SECONDS):
+        # The process holding it is gone
+        return True
+    if job.status == "running":
+        return now - (job.started_at or job.created_at) > timedelta(seconds=Config.JOB_TIMEOUT_SECONDS)
+    # Queued jobs whose process died never get claimed
+    return now - job.created_at > timedelta(seconds=Config.JOB_TIMEOUT_SECONDS)
+
+
+def enqueue(app: Flask, session_id: int, number: int) -> GenerationJob:
+    """Queue generation of chapter ``number`` unless a live job already covers it."""
+    now = datetime.utcnow()
+    job = active_job(session_id, number)
+    if job and not _is_stale(job, now):
+        return job
+    if job:
+        job.status = "failed"
+        job.error = "timed out"
+        job.finished_at = now
+    job = GenerationJob(session_id=session_id, number=number, status="queued", created_at=now)
+    db.session.add(job)
+    db.session.commit()
+    with _held_lock:
+        _held.add(job.id)
+    _ensure_heartbeat(app)
+    _executor.submit(_run, app, job.id)
+    return job
+
+
+def _ensure_heartbeat(app: Flask) -> None:
+    global _heartbeat
+    with _held_lock:
+        if _heartbeat is not None and _heartbeat.is_alive():
+            return
+        _heartbeat = threading.Thread(target=_heartbeat_loop, args=(app,), name="chapter-job-heartbeat", daemon=True)
+        _heartbeat.start()
+
+
+def _heartbeat_loop(app: Flask) -> None:
+    while True:
+        time.sleep(Config.JOB_HEARTBEAT_SECONDS)
+        with _held_lock:
+            held = list(_held)
+        if not held:
+            continue
+        with app.app_context():
+            try:
+                GenerationJob.query.filter(GenerationJob.id.in_(held), GenerationJob.status.in_(ACTIVE)).update(
+                    {"heartbeat_at": datetime.utcnow()}, synchronize_session=False
+                )
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Chapter job heartbeat failed: {e}")
+
+
+def active_job(session_id: int, number: int) -> GenerationJob | None:
+    return (
+        GenerationJob.query.filter(
+            GenerationJob.session_id == session_id,
+            GenerationJob.number == number,
+            GenerationJob.status.in_(ACTIVE),
+        )
+        .order_by(GenerationJob.id.desc())
+        .first()
+    )
+
+
+def cancel(session_id: int, from_number: int = 1) -> None:
+    """Mark queued and running jobs for chapter ``from_number`` onwards cancelled (not committed)."""
+    GenerationJob.query.filter(
+        GenerationJob.session_id == session_id, GenerationJob.number >= from_number, GenerationJob.status.in_(ACTIVE)
+    ).update({"status": "cancelled", "finished_at": datetime.utcnow()}, synchronize_session=False)
+
+
+def _own_job(job_id: int, session_id: int, number: int) -> GenerationJob | None:
+    # SQLite reuses the ids of deleted rows, so the id alone may now name another story's job
+    return GenerationJob.query.filter_by(id=job_id, session_id=session_id, number=number).first()
+
+
+def _still_wanted(job_id: int, session_id: int, number: int) -> bool:
+    """Whether the job may save its chapter: not cancelled, and the story still leads up to it."""
+    # End the read transaction so a cancel committed during generation is visible
+    db.session.commit()
+    job = _own_job(job_id, session_id, number)
+    if not job or job.status != "running" or not db.session.get(StorySession, session_id):
+        return False
+    return number == 1 or bool(Chapter.query.filter_by(session_id=session_id, number=number - 1).first())
+
+
+def _run(app: Flask, job_id: int) -> None:
+    try:
+        _run_claimed(app, job_id)
+    finally:
+        with _held_lock:
+            _held.discard(job_id)
+
+
+def _run_claimed(app: Flask, job_id: int) -> None:
+    with app.app_context():
+        # Claim atomically so a job picked up by another process is not run twice
+        claimed = GenerationJob.query.filter_by(id=job_id, status="queued").update(
+            {"status": "running", "started_at": datetime.utcnow()}, synchronize_session=False
+        )
+        db.session.commit()
+        if not claimed:
+            return
+        job = db.session.get(GenerationJob, job_id)
+        session_id, number = job.session_id, job.number
+        status, error = "done", None
+        try:
+            session_obj = db.session.get(StorySession, session_id)
+            if session_obj and not Chapter.query.filter_by(session_id=session_id, number=number).first():
+                prefetch.promote_or_create(session_obj, number, keep=lambda: _still_wanted(job_id, session_id, number))
+        except (GenerationCancelled, ObjectDeletedError):
+            # ObjectDeletedError: the story was deleted before generation got as far as asking
+            db.session.rollback()
+            status = "cancelled"
+        except Exception as e:
+            db.session.rollback()
+            print(f"Chapter job {job_id} failed: {e}")
+            status, error = "failed", str(e)[:500]
+        # delete_session removes the row; cancel() may already have finished it
+        job = _own_job(job_id, session_id, number)
+        if not job or job.status == "cancelled":
+            return
+        job.status = status
+        job.error = error
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+
+def status(app: Flask, session_id: int, number: int) -> dict:
+    """Report progress for chapter ``number``; stale jobs are re-queued on the way."""
+    if Chapter.query.filter_by(session_id=session_id, number=number).first():
+        return {"status": "done", "ready": True}
+    job = active_job(session_id, number)
+    if job and _is_stale(job, datetime.utcnow()):
+        job = enqueue(app, session_id, number)
+    if job:
+        return {"status": job.status, "ready": False}
+    last = GenerationJob.query.filter_by(session_id=session_id, number=number).order_by(GenerationJob.id.desc()).first()
+    if last and last.status == "failed":
+        # The stored error can name backend hosts; it stays in the table and the server log
+        return {"status": "failed", "ready": False, "error": "Generation failed, please retry"}
+    return {"status": "missing", "ready": False}
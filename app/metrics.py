@@ -0,0 +1,261 @@
+"""In-process metrics, served at ``/metrics`` in the Prometheus text format.
+
+Counters and histograms are dicts keyed by label values behind one lock, so
+recording a sample is a dict lookup and an add. Each process keeps its own
+numbers. Gunicorn workers share one port, so a scrape reaches whichever
+worker accepts it and counters would jump between workers' values; scrape
+a single-worker deployment (scale with ``--threads``) or one process per
+port. With ``METRICS_TOKEN`` set, scrapes must send it as a bearer token.
+
+Calls to AI backends are labelled with the ``AIService`` operation that
+made them (``extract_main_characters``, ``generate_chapter``,
+``_sd_txt2img``...). ``operation`` sets that label in a context variable for
+the duration of the decorated method.
+"""
+import bisect
+import functools
+import hmac
+import inspect
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Iterator, List, Tuple
+
+from . import timing
+from config import Config
+
+_lock = threading.Lock()
+_registry: List["Counter"] = []
+_operation: ContextVar[str] = ContextVar("ai_operation", default="other")
+
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+SQL_VERBS = {"SELECT", "INSERT", "UPDATE", "DELETE"}
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labels)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def lines(self) -> Iterator[str]:
+        with _lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labels, key)} {value}"
+
+
+class Histogram(Counter):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with _lock:
+            # Per-bucket counts (the last one is +Inf) followed by the sum
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def lines(self) -> Iterator[str]:
+        with _lock:
+            values = sorted((key, list(counts)) for key, counts in self._values.items())
+        names = self.labels + ("le",)
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip([*self.buckets, "+Inf"], counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(names, key + (str(bound),))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {counts[-1]}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}"
+
+
+AI_REQUEST_SECONDS = Histogram(
+    "ai_request_seconds", "Latency of single calls to AI backends.", ("provider", "model", "operation", "outcome")
+)
+AI_OPERATION_SECONDS = Histogram(
+    "ai_operation_seconds", "End-to-end latency of AIService operations, retries and fallbacks included.", ("operation",)
+)
+AI_FALLBACKS = Counter(
+    "ai_fallbacks_total", "Times an operation moved on to another model, backend or built-in default.", ("operation", "kind")
+)
+AI_STUB_CONTENT = Counter("ai_stub_content_total", "Results filled with built-in stub content.", ("operation",))
+AI_PARSE_FAILURES = Counter("ai_parse_failures_total", "Model outputs that did not parse as expected.", ("operation",))
+AI_TOKENS = Counter("ai_tokens_total", "Tokens reported by AI backends.", ("provider", "model", "operation", "kind"))
+AI_CHARS = Counter("ai_chars_total", "Characters sent to and received from AI backends.", ("provider", "model", "operation", "direction"))
+DB_QUERY_SECONDS = Histogram("db_query_seconds", "Latency of SQL statements.", ("statement",), DB_BUCKETS)
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds", "Time to produce a response (streamed bodies excluded).", ("method", "endpoint", "status")
+)
+
+
+def operation(name: str) -> Callable:
+    """Decorator: time the method as AI operation ``name`` and label the backend calls it makes."""
+
+    def decorate(fn: Callable) -> Callable:
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def stream(*args, **kwargs):
+                start = time.perf_counter()
+                chunks = fn(*args, **kwargs)
+                try:
+                    while True:
+                        # Set around each resume: the consumer may run between chunks in another context
+                        token = _operation.set(name)
+                        try:
+                            chunk = next(chunks)
+                        except StopIteration:
+                            return
+                        finally:
+                            _operation.reset(token)
+                        yield chunk
+                finally:
+                    chunks.close()
+                    AI_OPERATION_SECONDS.observe(time.perf_counter() - start, operation=name)
+
+            return stream
+
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            token = _operation.set(name)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                AI_OPERATION_SECONDS.observe(time.perf_counter() - start, operation=name)
+                _operation.reset(token)
+
+        return call
+
+    return decorate
+
+
+def ai_call(
+    provider: str,
+    model: str,
+    seconds: float,
+    ok: bool = True,
+    prompt: str | None = None,
+    response: str | None = None,
+    prompt_tokens: int | None = None,
+    completion_tokens: int | None = None,
+    phase: str = "llm",
+) -> None:
+    """Record one backend call under the current operation and in the request's Server-Timing ``phase``."""
+    timing.add(phase, seconds)
+    labels = {"provider": provider, "model": model, "operation": _operation.get()}
+    AI_REQUEST_SECONDS.observe(seconds, outcome="ok" if ok else "error", **labels)
+    if prompt is not None:
+        AI_CHARS.inc(len(prompt), direction="prompt", **labels)
+    if response is not None:
+        AI_CHARS.inc(len(response), direction="response", **labels)
+    if prompt_tokens:
+        AI_TOKENS.inc(prompt_tokens, kind="prompt", **labels)
+    if completion_tokens:
+        AI_TOKENS.inc(completion_tokens, kind="completion", **labels)
+
+
+def fallback(kind: str) -> None:
+    AI_FALLBACKS.inc(operation=_operation.get(), kind=kind)
+
+
+def stub_content() -> None:
+    AI_STUB_CONTENT.inc(operation=_operation.get())
+
+
+def parse_failure() -> None:
+    AI_PARSE_FAILURES.inc(operation=_operation.get())
+
+
+def instrument_engine(engine) -> None:
+    """Time every SQL statement on ``engine`` into ``db_query_seconds``."""
+    from sqlalchemy import event
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def after(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["query_start"].pop()
+        verb = statement.lstrip()[:6].upper()
+        DB_QUERY_SECONDS.observe(time.perf_counter() - start, statement=verb if verb in SQL_VERBS else "OTHER")
+
+    def failed(exception_context):
+        # after_cursor_execute is skipped when a statement raises
+        starts = exception_context.connection.info.get("query_start") if exception_context.connection else None
+        if starts:
+            starts.pop()
+
+    event.listen(engine, "before_cursor_execute", before)
+    event.listen(engine, "after_cursor_execute", after)
+    event.listen(engine, "handle_error", failed)
+
+
+def init_app(app) -> None:
+    """Time requests into ``http_request_seconds`` and SQL statements into ``db_query_seconds``."""
+    from flask import g, request
+
+    from . import db
+
+    with app.app_context():
+        instrument_engine(db.engine)
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop("request_start", None)
+        if start is not None:
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                method=request.method,
+                # The endpoint name, not the path, keeps the label set bounded
+                endpoint=request.endpoint or "unmatched",
+                status=response.status_code,
+            )
+        return response
+
+
+def authorized(header: str | None) -> bool:
+    """True if ``header`` (the request's Authorization) carries ``METRICS_TOKEN``, or no token is set."""
+    if not Config.METRICS_TOKEN:
+        return True
+    return hmac.compare_digest((header or "").encode(), f"Bearer {Config.METRICS_TOKEN}".encode())
+
+
+def render() -> str:
+    out = []
+    for metric in _registry:
+        out.append(f"# HELP {metric.name} {metric.help}")
+        out.append(f"# TYPE {metric.name} {metric.kind}")
+        out.extend(metric.lines())
+    return "\n".join(out) + "\n"
@@ -35,20 +35,121 @@ class StorySession(db.Model):
     selected_character = db.Column(db.String(255), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_complete = db.Column(db.Boolean, default=False)
+    characters = db.Column(db.Text, nullable=True)  # JSON list pinned on first character pick
+    # Rolling story state, folded forward one chapter at a time (see story.fold_chapter)
+    story_summary = db.Column(db.Text, nullable=True)
+    story_facts = db.Column(db.Text, nullable=True)  # JSON list of key decisions
+    summary_through = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # Ollama KV context after chapter llm_context_through (see story.pack_context)
+    llm_context = db.Column(db.LargeBinary, nullable=True)
+    llm_context_model = db.Column(db.String(120), nullable=True)
+    llm_context_through = db.Column(db.Integer, nullable=True)
+
+    # Index page: a user's sessions, newest first, keyset-paged on (created_at, id)
+    __table_args__ = (db.Index("ix_story_session_user_created", user_id, created_at.desc(), id.desc()),)
 
     chapters = db.relationship("Chapter", backref="session", lazy=True, order_by="Chapter.number")
 
 
 class Chapter(db.Model):
+    __table_args__ = (db.Index("uq_chapter_session_number", "session_id", "number", unique=True),)
+
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.Integer, db.ForeignKey("story_session.id"), nullable=False)
     number = db.Column(db.Integer, nullable=False)
-    content = db.Column(db.Text, nullable=False)
+    # Bodies are only needed by the chapter and session pages, which undefer them
+    content = db.deferred(db.Column(db.Text, nullable=False))
+    summary = db.Column(db.String(255), nullable=True)  # story.snippet(content), stored at write time
     choice_a = db.Column(db.String(255), nullable=True)
     choice_b = db.Column(db.String(255), nullable=True)
     choice_c = db.Column(db.String(255), nullable=True)
     selected_choice = db.Column(db.String(1), nullable=True)  # 'A'|'B'|'C'
     image_url = db.Column(db.String(512), nullable=True)
+    image_status = db.Column(db.String(16), nullable=True)  # pending|ready|failed, None for inline images
+    # The shared story-tree node this chapter was copied from or stored as; None for private chapters
+    story_node_id = db.Column(db.Integer, db.ForeignKey("story_node.id"), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class ChapterCandidate(db.Model):
+    """Speculatively generated next chapter for one of the three choices."""
+    __table_args__ = (db.UniqueConstraint("session_id", "number", "choice", name="uq_candidate_session_number_choice"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, db.ForeignKey("story_session.id"), nullable=False)
+    number = db.Column(db.Integer, nullable=False)
+    choice = db.Column(db.String(1), nullable=False)  # choice on chapter number-1 that leads here
+    content = db.Column(db.Text, nullable=False)
+    choice_a = db.Column(db.String(255), nullable=True)
+    choice_b = db.Column(db.String(255), nullable=True)
+    choice_c = db.Column(db.String(255), nullable=True)
+    image_url = db.Column(db.String(512), nullable=True)
+    llm_context = db.Column(db.LargeBinary, nullable=True)
+    llm_context_model = db.Column(db.String(120), nullable=True)
+    story_node_id = db.Column(db.Integer, db.ForeignKey("story_node.id"), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class GenerationJob(db.Model):
+    """Queued background generation of one chapter."""
+    __table_args__ = (db.Index("ix_generation_job_session_number", "session_id", "number"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, db.ForeignKey("story_session.id"), nullable=False)
+    number = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(16), nullable=False, default="queued")  # queued|running|done|failed|cancelled
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    # Refreshed by the owning process while the job is queued or running there
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+
+
+class GenerationLock(db.Model):
+    """Claim on generating one chapter; the primary key makes the insert the lock."""
+    session_id = db.Column(db.Integer, db.ForeignKey("story_session.id"), primary_key=True)
+    number = db.Column(db.Integer, primary_key=True)
+    owner = db.Column(db.String(64), nullable=False)
+    acquired_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class CharacterCache(db.Model):
+    """Main characters extracted for a book, shared across sessions."""
+    __table_args__ = (db.UniqueConstraint("title_key", "provider", "model", name="uq_character_cache_key"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    title_key = db.Column(db.String(255), nullable=False)
+    provider = db.Column(db.String(32), nullable=False)
+    model = db.Column(db.String(255), nullable=False)
+    characters = db.Column(db.Text, nullable=False)  # JSON list of names
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class StoryNode(db.Model):
+    """A chapter shared across sessions: the chapter reached in ``book_key`` as
+    ``character_key`` by the choices in ``path`` ("" for the opening chapter)."""
+    __table_args__ = (db.UniqueConstraint("book_key", "character_key", "path", name="uq_story_node_key"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    book_key = db.Column(db.String(255), nullable=False)
+    character_key = db.Column(db.String(255), nullable=False)
+    path = db.Column(db.String(64), nullable=False, default="")  # e.g. "ABA" leads to chapter 4
+    content = db.Column(db.Text, nullable=False)
+    summary = db.Column(db.String(255), nullable=True)
+    choice_a = db.Column(db.String(255), nullable=True)
+    choice_b = db.Column(db.String(255), nullable=True)
+    choice_c = db.Column(db.String(255), nullable=True)
+    image_url = db.Column(db.String(512), nullable=True)
+    hits = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class ImageIndex(db.Model):
+    """Maps a hashed image render request to its file in the content-addressed store."""
+    id = db.Column(db.Integer, primary_key=True)
+    request_hash = db.Column(db.String(64), nullable=False, unique=True)
+    url = db.Column(db.String(512), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
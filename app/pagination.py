@@ -0,0 +1,63 @@
+"""Keyset (cursor) pagination of a user's story sessions.
+
+Pages are ordered newest first on ``(created_at, id)``. The cursor encodes
+the last row of the previous page, so fetching any page is an index range
+scan on ``ix_story_session_user_created`` however many sessions precede it,
+unlike OFFSET.
+"""
+import base64
+from datetime import datetime
+from typing import List, Tuple
+
+from . import db
+from .models import StorySession
+from config import Config
+
+
+def encode_cursor(session_obj: StorySession) -> str:
+    raw = f"{session_obj.created_at.isoformat()}|{session_obj.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str | None) -> Tuple[datetime, int] | None:
+    """Return ``(created_at, id)`` from ``cursor``, or None if it is missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        created_at, session_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), int(session_id)
+    except ValueError:
+        return None
+
+
+def sessions_query(user_id: int, position: Tuple[datetime, int] | None = None):
+    """``user_id``'s sessions newest first, starting after ``position`` (``(created_at, id)``) if given."""
+    query = StorySession.query.filter(StorySession.user_id == user_id).options(
+        # The list never shows story state or the stored LLM context
+        db.load_only(
+            StorySession.id,
+            StorySession.book_title,
+            StorySession.selected_character,
+            StorySession.is_complete,
+            StorySession.created_at,
+        )
+    )
+    if position:
+        created_at, session_id = position
+        query = query.filter(
+            db.or_(
+                StorySession.created_at < created_at,
+                db.and_(StorySession.created_at == created_at, StorySession.id < session_id),
+            )
+        )
+    return query.order_by(StorySession.created_at.desc(), StorySession.id.desc())
+
+
+def session_page(user_id: int, after: str | None = None, limit: int | None = None) -> Tuple[List[StorySession], str | None]:
+    """Return one page of ``user_id``'s sessions after cursor ``after`` and the cursor for the next page."""
+    limit = max(1, min(limit or Config.SESSIONS_PAGE_SIZE, Config.SESSIONS_PAGE_MAX))
+    # One extra row tells us whether there is a next page without a COUNT
+    rows = sessions_query(user_id, decode_cursor(after)).limit(limit + 1).all()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
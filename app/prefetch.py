@@ -0,0 +1,145 @@
+"""Speculative generation of the next chapter for every choice.
+
+When a chapter is shown, the three possible follow-ups are generated on a
+small thread pool and stored as ``ChapterCandidate`` rows. Picking a choice
+promotes the matching candidate to a real ``Chapter`` and drops the rest.
+"""
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Callable
+
+from flask import Flask
+
+from . import db, single_flight
+from .models import Chapter, ChapterCandidate, StorySession
+from .story import create_chapter, generate_fields, save_chapter, share_chapter, shared_fields, story_context
+from config import Config
+
+CHOICES = ("A", "B", "C")
+
+_executor = ThreadPoolExecutor(max_workers=Config.PREFETCH_WORKERS, thread_name_prefix="prefetch")
+_inflight: dict[tuple[int, int, str], Future] = {}
+_lock = threading.Lock()
+
+
+def schedule(app: Flask, session_obj: StorySession, chapter: Chapter) -> None:
+    """Start generating chapter N+1 for each choice of ``chapter`` in the background."""
+    next_number = chapter.number + 1
+    if next_number > Config.MAX_CHAPTERS:
+        return
+    if Chapter.query.filter_by(session_id=session_obj.id, number=next_number).first():
+        return
+    ready = {
+        c.choice
+        for c in ChapterCandidate.query.filter_by(session_id=session_obj.id, number=next_number).all()
+    }
+    started = []
+    with _lock:
+        for choice in CHOICES:
+            key = (session_obj.id, next_number, choice)
+            if choice in ready or key in _inflight:
+                continue
+            future = _executor.submit(_generate, app, session_obj.id, next_number, choice, (chapter.id, chapter.created_at))
+            _inflight[key] = future
+            started.append((key, future))
+    # Outside the lock: a future that is already done runs the callback right here
+    for key, future in started:
+        future.add_done_callback(lambda _f, key=key: _forget(key))
+
+
+def _forget(key: tuple[int, int, str]) -> None:
+    with _lock:
+        _inflight.pop(key, None)
+
+
+def _generate(app: Flask, session_id: int, number: int, choice: str, parent: tuple) -> None:
+    with app.app_context():
+        try:
+            session_obj = db.session.get(StorySession, session_id)
+            if not session_obj:
+                return
+            override = (number - 1, choice)
+            fields = shared_fields(session_obj, number, override)
+            if not fields:
+                fields = generate_fields(session_obj, number, story_context(session_obj, number, override))
+                if fields.pop("stub"):
+                    # Leave the chapter to be generated for real if the reader picks this branch
+                    return
+                if Config.SHARED_STORY_TREE:
+                    # Branches this reader never picks are still worth keeping for the next one
+                    fields["story_node_id"] = share_chapter(session_obj, number, fields, override)
+            # The reader may have moved on (or gone back) while we were generating
+            if Chapter.query.filter_by(session_id=session_id, number=number).first():
+                return
+            # ...or replaced the chapter this branches from, making the candidate stale.
+            # created_at too: SQLite can hand the replacement the deleted row's id
+            current = Chapter.query.filter_by(session_id=session_id, number=number - 1).first()
+            if not current or (current.id, current.created_at) != parent:
+                return
+            db.session.add(ChapterCandidate(session_id=session_id, number=number, choice=choice, **fields))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Prefetch of chapter {number}{choice} for session {session_id} failed: {e}")
+
+
+def take(session_id: int, number: int, choice: str, wait: bool = True) -> ChapterCandidate | None:
+    """Return the candidate for ``choice``, waiting briefly if it is still being generated."""
+    with _lock:
+        future = _inflight.get((session_id, number, choice))
+    if future is not None:
+        if not wait:
+            return None
+        try:
+            future.result(timeout=Config.PREFETCH_WAIT_SECONDS)
+        except FutureTimeout:
+            return None
+    return ChapterCandidate.query.filter_by(session_id=session_id, number=number, choice=choice).first()
+
+
+def promote(candidate: ChapterCandidate) -> Chapter:
+    """Turn ``candidate`` into the real chapter and drop its siblings."""
+    fields = {
+        "content": candidate.content,
+        "choice_a": candidate.choice_a,
+        "choice_b": candidate.choice_b,
+        "choice_c": candidate.choice_c,
+        "image_url": candidate.image_url,
+        "llm_context": candidate.llm_context,
+        "llm_context_model": candidate.llm_context_model,
+        "story_node_id": candidate.story_node_id,
+    }
+    session_obj = db.session.get(StorySession, candidate.session_id)
+    discard(candidate.session_id, candidate.number, commit=False)
+    # Candidates were copied from or already stored in the story tree when it is shared
+    return save_chapter(session_obj, candidate.number, fields, share=False)
+
+
+def promote_or_create(session_obj: StorySession, number: int, keep: Callable[[], bool] | None = None) -> Chapter:
+    """Produce chapter ``number`` from a prefetched candidate if there is one, else generate it.
+
+    Concurrent calls for the same chapter share one generation (``single_flight``).
+    ``keep`` is passed on to ``create_chapter``.
+    """
+    return single_flight.run(session_obj.id, number, lambda: _promote_or_create(session_obj, number, keep))
+
+
+def _promote_or_create(session_obj: StorySession, number: int, keep: Callable[[], bool] | None = None) -> Chapter:
+    if Config.PREFETCH_CHAPTERS and number > 1:
+        prev = Chapter.query.filter_by(session_id=session_obj.id, number=number - 1).first()
+        if prev and prev.selected_choice:
+            candidate = take(session_obj.id, number, prev.selected_choice)
+            if candidate:
+                return promote(candidate)
+    chapter = create_chapter(session_obj, number, keep)
+    discard(session_obj.id, number)
+    return chapter
+
+
+def discard(session_id: int, from_number: int = 1, commit: bool = True) -> None:
+    """Delete candidates for ``session_id`` at or beyond ``from_number``."""
+    ChapterCandidate.query.filter(
+        ChapterCandidate.session_id == session_id, ChapterCandidate.number >= from_number
+    ).delete(synchronize_session=False)
+    if commit:
+        db.session.commit()
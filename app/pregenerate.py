@@ -0,0 +1,80 @@
+"""``flask pregenerate``: fill the shared caches for popular books offline.
+
+For each title the character list is extracted into ``character_cache``,
+then the opening chapter for every character is generated into the story
+tree (path ""). Work is spread over a process pool; each worker builds its
+own app, so model calls and database connections are never shared across
+processes.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+import click
+from flask.cli import with_appcontext
+
+_app = None
+
+
+def _init_worker() -> None:
+    global _app
+    from . import create_app
+
+    _app = create_app()
+
+
+def _characters(book_title: str) -> List[str]:
+    from .character_cache import get_characters, is_placeholder
+
+    with _app.app_context():
+        names = get_characters(book_title)
+        # No point pre-generating openings for placeholder characters
+        return [] if is_placeholder(book_title, names) else names
+
+
+def _opening(book_title: str, character: str, with_image: bool) -> str:
+    from . import story_tree
+    from .story import ai_service, chapter_fields, snippet
+
+    with _app.app_context():
+        if story_tree.lookup(book_title, character, ""):
+            return "cached"
+        draft = ai_service.generate_chapter(
+            book_title=book_title, character=character, chapter_num=1, history=[], with_image=with_image, summary="", facts=[]
+        )
+        if draft.stub:
+            raise RuntimeError("the model returned no text")
+        fields = chapter_fields(*draft)
+        story_tree.store(book_title, character, "", fields, summary=snippet(fields["content"]))
+        return "generated"
+
+
+@click.command("pregenerate")
+@click.argument("titles", nargs=-1)
+@click.option("--file", "titles_file", type=click.File("r"), help="Read book titles from a file, one per line.")
+@click.option("--workers", type=int, default=4, show_default=True, help="Worker processes.")
+@click.option("--images/--no-images", default=True, show_default=True, help="Also render the opening chapter images.")
+@with_appcontext
+def pregenerate_command(titles, titles_file, workers, images):
+    """Pre-compute characters and opening chapters for TITLES."""
+    titles = [t.strip() for t in titles if t.strip()]
+    if titles_file:
+        titles += [line.strip() for line in titles_file if line.strip() and not line.startswith("#")]
+    if not titles:
+        raise click.UsageError("Give at least one book title or --file.")
+
+    # spawn: workers must not inherit this process's DB connections or model clients
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker) as pool:
+        jobs = []
+        for title, names in zip(titles, pool.map(_characters, titles)):
+            click.echo(f"{title}: {', '.join(names) or 'no characters (backend unavailable?)'}")
+            jobs += [(title, name, pool.submit(_opening, title, name, images)) for name in names]
+        counts = {"generated": 0, "cached": 0, "failed": 0}
+        for title, name, future in jobs:
+            try:
+                outcome = future.result()
+            except Exception as e:
+                outcome = "failed"
+                click.echo(f"  {title} / {name}: failed: {e}", err=True)
+            counts[outcome] += 1
+    click.echo(f"Opening chapters: {counts['generated']} generated, {counts['cached']} already cached, {counts['failed']} failed")
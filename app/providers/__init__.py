@@ -0,0 +1,29 @@
+"""Text-generation provider plug-ins.
+
+Each provider lives in its own module and is imported only when selected via
+``AI_PROVIDER``, so an Ollama deployment never pays for importing the OpenAI
+or Gemini SDKs. A provider exposes ``label``, ``generate(prompt, max_tokens)``
+and ``stream(prompt)``.
+"""
+import importlib
+
+PROVIDERS = {
+	"ollama": "app.providers.ollama:OllamaProvider",
+	"gemini": "app.providers.gemini:GeminiProvider",
+	"openai": "app.providers.openai:OpenAIProvider",
+}
+
+
+def load_provider(name: str, service):
+	"""Import and construct provider ``name``; None for stub mode or an unusable provider."""
+	target = PROVIDERS.get(name)
+	if not target:
+		return None
+	module_name, class_name = target.split(":")
+	try:
+		module = importlib.import_module(module_name)
+	except ImportError as e:
+		print(f"AI provider '{name}' is unavailable: {e}")
+		return None
+	provider = getattr(module, class_name)(service)
+	return provider if provider.available else None
@@ -0,0 +1,214 @@
+import os
+import threading
+import time
+
+from .. import metrics
+from config import Config
+
+try:
+	import google.generativeai as genai
+	GEMINI_AVAILABLE = True
+except Exception:
+	GEMINI_AVAILABLE = False
+
+
+GEMINI_MODEL_NAMES = [
+	'gemini-2.5-flash',
+	'gemini-2.0-flash',
+	'gemini-flash-latest',
+	'gemini-pro-latest',
+]
+
+
+class GeminiModelSelector:
+	"""Pick a working Gemini model without blocking startup.
+
+	Until a probe result is known the first candidate is used optimistically.
+	The probe (one ``generate_content("test")`` per candidate, in preference
+	order) runs on a background thread, and its result is written to
+	``Config.GEMINI_PROBE_CACHE`` so other workers and restarts reuse it for
+	``Config.GEMINI_PROBE_TTL`` seconds. A lock file keeps concurrent workers
+	from probing at the same time. When every candidate fails, the failure is
+	written to the same file and no worker probes again until a backoff that
+	doubles per consecutive failure (``GEMINI_PROBE_BACKOFF`` up to
+	``GEMINI_PROBE_BACKOFF_MAX``) has passed.
+	"""
+
+	RECHECK_SECONDS = 5.0
+
+	def __init__(self, api_key: str):
+		import hashlib
+		self.key_id = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+		self.cache_path = Config.GEMINI_PROBE_CACHE
+		self.lock_path = self.cache_path + ".lock"
+		self.model_name: str | None = None
+		self._model = None
+		self._resolved = False
+		self._last_check = 0.0
+		self._probing = False
+		self._lock = threading.Lock()
+
+	def model(self):
+		with self._lock:
+			if self._resolved:
+				return self._model
+			now = time.monotonic()
+			if now - self._last_check >= self.RECHECK_SECONDS:
+				self._last_check = now
+				state = self._read_state()
+				cached = self._cached_model(state)
+				if cached:
+					self._use(cached, resolved=True)
+					return self._model
+				if time.time() >= self._retry_at(state):
+					self._start_probe()
+			if self._model is None:
+				self._use(GEMINI_MODEL_NAMES[0], resolved=False)
+			return self._model
+
+	def _use(self, model_name: str, resolved: bool) -> None:
+		self._model = genai.GenerativeModel(model_name)
+		self.model_name = model_name
+		self._resolved = resolved
+
+	def _read_state(self) -> dict | None:
+		import json
+		try:
+			with open(self.cache_path) as f:
+				data = json.load(f)
+		except (OSError, ValueError):
+			return None
+		if not isinstance(data, dict) or data.get("key_id") != self.key_id:
+			return None
+		return data
+
+	def _cached_model(self, state: dict | None) -> str | None:
+		if not state or state.get("model") not in GEMINI_MODEL_NAMES:
+			return None
+		if time.time() - float(state.get("probed_at", 0)) > Config.GEMINI_PROBE_TTL:
+			return None
+		return state["model"]
+
+	def _retry_at(self, state: dict | None) -> float:
+		"""Wall-clock time before which no worker should probe again after failed probes."""
+		failures = int(state.get("failures", 0)) if state and not state.get("model") else 0
+		if not failures:
+			return 0.0
+		backoff = min(Config.GEMINI_PROBE_BACKOFF * 2 ** (failures - 1), Config.GEMINI_PROBE_BACKOFF_MAX)
+		return float(state.get("probed_at", 0)) + backoff
+
+	def _write_cache(self, model_name: str | None, failures: int = 0) -> None:
+		import json
+		tmp = f"{self.cache_path}.{os.getpid()}.tmp"
+		state = {"model": model_name, "probed_at": time.time(), "key_id": self.key_id}
+		if failures:
+			state["failures"] = failures
+		try:
+			with open(tmp, "w") as f:
+				json.dump(state, f)
+			os.replace(tmp, self.cache_path)
+		except OSError as e:
+			print(f"Could not write Gemini probe cache: {e}")
+
+	def _start_probe(self) -> None:
+		if self._probing:
+			return
+		try:
+			# A lock younger than the probe timeout means another worker is probing
+			if time.time() - os.path.getmtime(self.lock_path) < Config.GEMINI_PROBE_LOCK_SECONDS:
+				return
+			os.remove(self.lock_path)
+		except OSError:
+			pass
+		try:
+			fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+			os.close(fd)
+		except OSError:
+			return
+		self._probing = True
+		threading.Thread(target=self._probe, name="gemini-probe", daemon=True).start()
+
+	def _probe(self) -> None:
+		try:
+			for model_name in GEMINI_MODEL_NAMES:
+				try:
+					test_response = genai.GenerativeModel(model_name).generate_content("test")
+					if test_response and hasattr(test_response, 'text'):
+						print(f"Successfully initialized Gemini with model: {model_name}")
+						self._write_cache(model_name)
+						with self._lock:
+							self._use(model_name, resolved=True)
+						return
+				except Exception as e:
+					print(f"Failed to initialize model {model_name}: {e}")
+					continue
+			# Every candidate failed: record it so no worker sweeps again until the backoff passes
+			state = self._read_state()
+			failures = (int(state.get("failures", 0)) if state and not state.get("model") else 0) + 1
+			self._write_cache(None, failures)
+			print(f"No Gemini model answered; next probe in {self._retry_at(self._read_state()) - time.time():.0f}s")
+		finally:
+			self._probing = False
+			try:
+				os.remove(self.lock_path)
+			except OSError:
+				pass
+
+
+class GeminiProvider:
+	name = "gemini"
+
+	def __init__(self, service):
+		self.selector = None
+		if service.api_key and GEMINI_AVAILABLE:
+			genai.configure(api_key=service.api_key)
+			self.selector = GeminiModelSelector(service.api_key)
+		self.available = self.selector is not None
+
+	@property
+	def label(self) -> str:
+		self.selector.model()
+		return self.selector.model_name or ""
+
+	def stream(self, prompt: str, max_tokens: int | None = None):
+		model = self.selector.model()
+		if not model:
+			return
+		start = time.monotonic()
+		parts = []
+		try:
+			for chunk in model.generate_content(prompt, stream=True):
+				text = getattr(chunk, "text", "")
+				if text:
+					parts.append(text)
+					yield text
+		except Exception as e:
+			print(f"Gemini streaming failed: {e}")
+			metrics.ai_call("gemini", self.selector.model_name or "", time.monotonic() - start, ok=False, prompt=prompt)
+			return
+		metrics.ai_call("gemini", self.selector.model_name or "", time.monotonic() - start, prompt=prompt, response="".join(parts))
+
+	def generate(self, prompt: str, max_tokens: int | None = None) -> str:
+		"""Generate text using Gemini API"""
+		model = self.selector.model()
+		if not model:
+			return ""
+		start = time.monotonic()
+		try:
+			response = model.generate_content(prompt)
+			usage = getattr(response, "usage_metadata", None)
+			metrics.ai_call(
+				"gemini", self.selector.model_name or "", time.monotonic() - start, prompt=prompt,
+				response=getattr(response, "text", "") if response else "",
+				prompt_tokens=getattr(usage, "prompt_token_count", None),
+				completion_tokens=getattr(usage, "candidates_token_count", None),
+			)
+			if response and hasattr(response, 'text') and response.text:
+				return response.text.strip()
+			else:
+				print(f"Gemini response was empty or invalid: {response}")
+				return ""
+		except Exception as e:
+			print(f"Gemini generation failed: {e}")
+			metrics.ai_call("gemini", self.selector.model_name or "", time.monotonic() - start, ok=False, prompt=prompt)
+			return ""
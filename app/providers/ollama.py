@@ -0,0 +1,224 @@
+import json
+import time
+from typing import List, Tuple
+
+from .. import metrics
+from config import Config
+
+
+# (model name, token ids) as returned in Ollama's ``context`` field
+LLMContext = Tuple[str, List[int]]
+
+
+class OllamaProvider:
+	name = "ollama"
+	available = True
+	# /api/generate returns the KV ``context`` so a session can continue from it
+	keeps_context = True
+
+	def __init__(self, service):
+		self.health = service.health
+		self.transport = service.transport
+		self.base = Config.OLLAMA_BASE_URL.rstrip("/") if Config.OLLAMA_BASE_URL else "http://127.0.0.1:11434"
+		# Support comma-separated list of models for fallback, e.g. "llama3.1:70b, llama3.1:8b, llama3.2"
+		ollama_models = (Config.OLLAMA_MODEL or "llama3.2").split(",")
+		self.models: List[str] = [m.strip() for m in ollama_models if m.strip()]
+
+		# Circuit breakers: one for the host plus one per model, each with a
+		# cheap probe the background prober uses to close it again.
+		service.health.set_probe("ollama", lambda: service.probe("ollama", "GET", f"{self.base}/api/tags"))
+		for model_name in self.models:
+			# An empty prompt just loads the model, so this also catches models that fail to load
+			service.health.set_probe(
+				f"ollama:{model_name}",
+				lambda m=model_name: service.probe("ollama", "POST", f"{self.base}/api/generate", json={"model": m, "prompt": "", "stream": False}),
+			)
+		# Extra hosts serving the same models, used only as hedging targets
+		self.hedge_bases: List[str] = Config.OLLAMA_HEDGE_URLS if Config.HEDGE_REQUESTS else []
+		for base in self.hedge_bases:
+			for model_name in self.models:
+				service.health.set_probe(
+					self._breaker_name(model_name, base),
+					lambda b=base, m=model_name: service.probe("ollama", "POST", f"{b}/api/generate", json={"model": m, "prompt": "", "stream": False}),
+				)
+
+	@property
+	def label(self) -> str:
+		return ",".join(self.models)
+
+	def generate(self, prompt: str, max_tokens: int | None = None) -> str:
+		return self.generate_with_context(prompt, max_tokens=max_tokens)[0]
+
+	def _breaker_name(self, model_name: str, base: str) -> str:
+		return f"ollama:{model_name}" if base == self.base else f"ollama:{model_name}@{base}"
+
+	def _candidates(self, context: LLMContext | None) -> List[str]:
+		# Context tokens only make sense to the model that produced them
+		if context:
+			return [context[0]] if context[0] in self.models else []
+		return self.models
+
+	def _payload(self, model_name: str, prompt: str, context: LLMContext | None, stream: bool) -> dict:
+		payload = {
+			"model": model_name,
+			"prompt": prompt,
+			"stream": stream,
+			"options": {"temperature": 0.2, "num_ctx": 8192},
+		}
+		if context:
+			payload["context"] = context[1]
+		return payload
+
+	def generate_with_context(self, prompt: str, context: LLMContext | None = None, max_tokens: int | None = None) -> Tuple[str, LLMContext | None]:
+		"""Generate text, continuing from ``context`` if given, and return the new context too."""
+		# Try configured models in order until one returns non-empty text,
+		# skipping the host or any model whose circuit breaker is open
+		if not self.health.breaker("ollama").available():
+			return "", None
+		for i, model_name in enumerate(self._candidates(context)):
+			name = f"ollama:{model_name}"
+			if not self.health.breaker(name).allow():
+				continue
+			if i:
+				metrics.fallback("next_model")
+			start = time.monotonic()
+			try:
+				resp = self.transport.post(
+					"ollama",
+					f"{self.base}/api/generate",
+					json=self._payload(model_name, prompt, context, stream=False),
+					read_timeout=Config.OLLAMA_READ_TIMEOUT,
+				)
+				resp.raise_for_status()
+				data = resp.json()
+			except Exception as e:
+				self.health.failure(name, e, backend="ollama")
+				metrics.ai_call("ollama", model_name, time.monotonic() - start, ok=False, prompt=prompt)
+				continue
+			except BaseException:
+				# Abandoned mid-call (worker shutdown): free the half-open trial without an outcome
+				self.health.breaker(name).release()
+				raise
+			self.health.success(name, time.monotonic() - start, backend="ollama")
+			text = (data.get("response", "") or "").strip()
+			metrics.ai_call(
+				"ollama", model_name, time.monotonic() - start, prompt=prompt, response=text,
+				prompt_tokens=data.get("prompt_eval_count"), completion_tokens=data.get("eval_count"),
+			)
+			if text:
+				tokens = data.get("context")
+				return text, ((model_name, tokens) if tokens else None)
+		return "", None
+
+	def attempts(self, prompt: str, context: LLMContext | None = None) -> list:
+		"""Hedging attempts for ``prompt``: one per model (in order) and host whose breaker is not open."""
+		attempts = []
+		for model_name in self._candidates(context):
+			for base in [self.base, *self.hedge_bases]:
+				if base == self.base and not self.health.breaker("ollama").available():
+					continue
+				name = self._breaker_name(model_name, base)
+				# available(), not allow(): an attempt that is never started must not hold the half-open trial
+				if not self.health.breaker(name).available():
+					continue
+				attempts.append((name, lambda cancelled, b=base, m=model_name, n=name: self._generate_cancellable(b, m, n, prompt, context, cancelled)))
+		return attempts
+
+	def _generate_cancellable(self, base: str, model_name: str, name: str, prompt: str, context: LLMContext | None, cancelled) -> Tuple[str, LLMContext | None]:
+		# Streamed so that a losing attempt can hang up between chunks, which makes Ollama stop generating
+		# The "ollama" host breaker tracks the primary server only
+		host = "ollama" if base == self.base else None
+		start = time.monotonic()
+		parts: List[str] = []
+		tokens = None
+		data: dict = {}
+		try:
+			with self.transport.post(
+				"ollama",
+				f"{base}/api/generate",
+				json=self._payload(model_name, prompt, context, stream=True),
+				read_timeout=Config.OLLAMA_READ_TIMEOUT,
+				stream=True,
+			) as resp:
+				resp.raise_for_status()
+				for line in resp.iter_lines():
+					if cancelled.is_set():
+						return "", None
+					if not line:
+						continue
+					data = json.loads(line)
+					parts.append(data.get("response", ""))
+					if data.get("done"):
+						tokens = data.get("context")
+						break
+		except Exception as e:
+			if not cancelled.is_set():
+				self.health.failure(name, e, backend=host)
+				metrics.ai_call("ollama", model_name, time.monotonic() - start, ok=False, prompt=prompt)
+			raise
+		self.health.success(name, time.monotonic() - start, backend=host)
+		text = "".join(parts).strip()
+		metrics.ai_call(
+			"ollama", model_name, time.monotonic() - start, prompt=prompt, response=text,
+			prompt_tokens=data.get("prompt_eval_count"), completion_tokens=data.get("eval_count"),
+		)
+		return text, ((model_name, tokens) if text and tokens else None)
+
+	def stream(self, prompt: str, max_tokens: int | None = None, context: LLMContext | None = None, result: dict | None = None):
+		# Stream NDJSON from the first model that answers; once a model has
+		# produced text we stay on it rather than mixing outputs. The final
+		# message carries the new KV context, stored in ``result["context"]``.
+		if not self.health.breaker("ollama").available():
+			return
+		for i, model_name in enumerate(self._candidates(context)):
+			name = f"ollama:{model_name}"
+			if not self.health.breaker(name).allow():
+				continue
+			if i:
+				metrics.fallback("next_model")
+			produced = False
+			parts: List[str] = []
+			start = time.monotonic()
+			try:
+				with self.transport.post(
+					"ollama",
+					f"{self.base}/api/generate",
+					json=self._payload(model_name, prompt, context, stream=True),
+					read_timeout=Config.OLLAMA_READ_TIMEOUT,
+					stream=True,
+				) as resp:
+					resp.raise_for_status()
+					for line in resp.iter_lines():
+						if not line:
+							continue
+						data = json.loads(line)
+						chunk = data.get("response", "")
+						if chunk:
+							if not produced:
+								# For streams the breaker tracks time to first token
+								self.health.success(name, time.monotonic() - start, backend="ollama")
+								produced = True
+							parts.append(chunk)
+							yield chunk
+						if data.get("done"):
+							if result is not None and data.get("context"):
+								result["context"] = (model_name, data["context"])
+							metrics.ai_call(
+								"ollama", model_name, time.monotonic() - start, prompt=prompt, response="".join(parts),
+								prompt_tokens=data.get("prompt_eval_count"), completion_tokens=data.get("eval_count"),
+							)
+							break
+			except Exception as e:
+				print(f"Ollama streaming with {model_name} failed: {e}")
+				metrics.ai_call("ollama", model_name, time.monotonic() - start, ok=False, prompt=prompt, response="".join(parts))
+				if not produced:
+					self.health.failure(name, e, backend="ollama")
+					continue
+			except BaseException:
+				# GeneratorExit (client went away) or worker shutdown: neither a success nor a failure
+				if not produced:
+					self.health.breaker(name).release()
+				raise
+			if produced:
+				return
+			self.health.success(name, time.monotonic() - start, backend="ollama")
@@ -0,0 +1,62 @@
+import time
+
+from .. import metrics
+from config import Config
+
+try:
+	from openai import OpenAI
+	OPENAI_AVAILABLE = True
+except Exception:
+	OPENAI_AVAILABLE = False
+
+
+class OpenAIProvider:
+	name = "openai"
+	label = "gpt-4o-mini"
+
+	def __init__(self, service):
+		api_key = Config.OPENAI_API_KEY or service.api_key
+		self.client = OpenAI(api_key=api_key) if (api_key and OPENAI_AVAILABLE) else None
+		self.available = self.client is not None
+
+	def generate(self, prompt: str, max_tokens: int = 600) -> str:
+		start = time.monotonic()
+		try:
+			resp = self.client.chat.completions.create(
+				model=self.label,
+				messages=[{"role": "user", "content": prompt}],
+				max_tokens=max_tokens,
+			)
+			text = (resp.choices[0].message.content or "").strip()
+		except Exception as e:
+			print(f"OpenAI generation failed: {e}")
+			metrics.ai_call("openai", self.label, time.monotonic() - start, ok=False, prompt=prompt)
+			return ""
+		usage = getattr(resp, "usage", None)
+		metrics.ai_call(
+			"openai", self.label, time.monotonic() - start, prompt=prompt, response=text,
+			prompt_tokens=getattr(usage, "prompt_tokens", None),
+			completion_tokens=getattr(usage, "completion_tokens", None),
+		)
+		return text
+
+	def stream(self, prompt: str, max_tokens: int = 600):
+		start = time.monotonic()
+		parts = []
+		try:
+			resp = self.client.chat.completions.create(
+				model=self.label,
+				messages=[{"role": "user", "content": prompt}],
+				max_tokens=max_tokens,
+				stream=True,
+			)
+			for chunk in resp:
+				delta = chunk.choices[0].delta.content if chunk.choices else None
+				if delta:
+					parts.append(delta)
+					yield delta
+		except Exception as e:
+			print(f"OpenAI streaming failed: {e}")
+			metrics.ai_call("openai", self.label, time.monotonic() - start, ok=False, prompt=prompt)
+			return
+		metrics.ai_call("openai", self.label, time.monotonic() - start, prompt=prompt, response="".join(parts))
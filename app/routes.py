@@ -1,28 +1,67 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, Response, abort, current_app, get_flashed_messages, jsonify, render_template, request, redirect, stream_template, stream_with_context, url_for, flash
 from flask_login import login_required, current_user
-from . import db
-from .models import StorySession, Chapter
-from .ai_service import AIService
+from . import db, image_store, images, jobs, metrics, prefetch, single_flight, story_tree
+from .models import GenerationJob, GenerationLock, StorySession, Chapter
+from .story import advance_story_state, ai_service, chapter_from_tree, reset_story_state, stream_chapter
+from .character_cache import get_characters, is_placeholder
+from .pagination import session_page
 from config import Config
+import json
 import os
 from werkzeug.utils import secure_filename
 import bleach
 
 main_bp = Blueprint("main", __name__)
 
-ai_service = AIService(api_key=Config.GEMINI_API_KEY)
-
 
 @main_bp.get("/")
 def marketing():
 	return render_template("marketing.html")
 
 
+@main_bp.get("/health/backends")
+def backend_health():
+	return jsonify(ai_service.health.snapshot())
+
+
+@main_bp.get("/health/story-tree")
+def story_tree_health():
+	return jsonify(story_tree.stats())
+
+
+@main_bp.get("/metrics")
+def metrics_endpoint():
+	if not Config.METRICS:
+		return jsonify({"error": "Metrics are disabled"}), 404
+	if not metrics.authorized(request.headers.get("Authorization")):
+		return jsonify({"error": "Unauthorized"}), 401
+	return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
 @main_bp.get("/app")
 @login_required
 def index():
-	sessions = StorySession.query.filter_by(user_id=current_user.id).order_by(StorySession.created_at.desc()).all()
-	return render_template("index.html", sessions=sessions)
+	sessions, next_cursor = session_page(current_user.id, request.args.get("after"))
+	return render_template("index.html", sessions=sessions, next_cursor=next_cursor, paged=bool(request.args.get("after")))
+
+
+@main_bp.get("/api/sessions")
+@login_required
+def list_sessions():
+	sessions, next_cursor = session_page(current_user.id, request.args.get("after"), request.args.get("limit", type=int))
+	return jsonify({
+		"sessions": [
+			{
+				"id": s.id,
+				"book_title": s.book_title,
+				"selected_character": s.selected_character,
+				"is_complete": bool(s.is_complete),
+				"created_at": s.created_at.isoformat() if s.created_at else None,
+			}
+			for s in sessions
+		],
+		"next": next_cursor,
+	})
 
 
 @main_bp.post("/start")
@@ -47,6 +86,10 @@ def delete_session(session_id: int):
 		flash("Not authorized", "danger")
 		return redirect(url_for("main.index"))
 	# delete chapters first to satisfy FK
+	prefetch.discard(session_id, commit=False)
+	# Running jobs see their row gone and drop what they generate
+	GenerationJob.query.filter_by(session_id=session_id).delete()
+	GenerationLock.query.filter_by(session_id=session_id).delete()
 	Chapter.query.filter_by(session_id=session_id).delete()
 	db.session.delete(session_obj)
 	db.session.commit()
@@ -61,7 +104,14 @@ def choose_character(session_id: int):
 	if session_obj.user_id != current_user.id:
 		flash("Not authorized", "danger")
 		return redirect(url_for("main.index"))
-	characters = ai_service.extract_main_characters(session_obj.book_title)
+	if session_obj.characters:
+		characters = json.loads(session_obj.characters)
+	else:
+		characters = get_characters(session_obj.book_title)
+		# A placeholder list from a backend outage is shown but not kept, so the next visit retries
+		if not is_placeholder(session_obj.book_title, characters):
+			session_obj.characters = json.dumps(characters)
+			db.session.commit()
 	return render_template("choose_character.html", session=session_obj, characters=characters)
 
 
@@ -88,33 +138,67 @@ def chapter(session_id: int, number: int):
 	if session_obj.user_id != current_user.id:
 		flash("Not authorized", "danger")
 		return redirect(url_for("main.index"))
-	chapter = Chapter.query.filter_by(session_id=session_id, number=number).first()
+	chapter = Chapter.query.filter_by(session_id=session_id, number=number).options(db.undefer(Chapter.content)).first()
+	if not chapter:
+		# Pre-generated chapters are a DB copy, so serve them inline in every mode
+		chapter = chapter_from_tree(session_obj, number)
 	if not chapter:
+		if Config.STREAM_CHAPTERS:
+			return render_template("generating.html", session=session_obj, number=number, stream=True)
+		if Config.ASYNC_GENERATION:
+			jobs.enqueue(current_app._get_current_object(), session_id, number)
+			return render_template("generating.html", session=session_obj, number=number)
 		# generate new chapter
-		history = []
-		prev_chapters = Chapter.query.filter_by(session_id=session_id).order_by(Chapter.number.asc()).all()
-		for ch in prev_chapters:
-			history.append((ch.number, ch.content[:120].replace("\n", " ") + ("..." if len(ch.content) > 120 else ""), ch.selected_choice or ""))
-		content, choices, image_url = ai_service.generate_chapter(
-			book_title=session_obj.book_title,
-			character=session_obj.selected_character or "Protagonist",
-			chapter_num=number,
-			history=history,
-		)
-		chapter = Chapter(
-			session_id=session_id,
-			number=number,
-			content=content,
-			choice_a=choices[0] if len(choices) > 0 else None,
-			choice_b=choices[1] if len(choices) > 1 else None,
-			choice_c=choices[2] if len(choices) > 2 else None,
-			image_url=image_url,
-		)
-		db.session.add(chapter)
-		db.session.commit()
+		chapter = prefetch.promote_or_create(session_obj, number)
+	if Config.PREFETCH_CHAPTERS:
+		prefetch.schedule(current_app._get_current_object(), session_obj, chapter)
 	return render_template("chapter.html", session=session_obj, chapter=chapter)
 
 
+@main_bp.get("/session/<int:session_id>/chapter/<int:number>/status")
+@login_required
+def chapter_status(session_id: int, number: int):
+	session_obj = StorySession.query.get_or_404(session_id)
+	if session_obj.user_id != current_user.id:
+		return jsonify({"error": "Not authorized"}), 403
+	return jsonify(jobs.status(current_app._get_current_object(), session_id, number))
+
+
+@main_bp.get("/session/<int:session_id>/chapter/<int:number>/image")
+@login_required
+def chapter_image(session_id: int, number: int):
+	session_obj = StorySession.query.get_or_404(session_id)
+	if session_obj.user_id != current_user.id:
+		return jsonify({"error": "Not authorized"}), 403
+	chapter = Chapter.query.filter_by(session_id=session_id, number=number).first_or_404()
+	return jsonify(images.status(current_app._get_current_object(), chapter))
+
+
+@main_bp.get("/session/<int:session_id>/chapter/<int:number>/stream")
+@login_required
+def chapter_stream(session_id: int, number: int):
+	session_obj = StorySession.query.get_or_404(session_id)
+	if session_obj.user_id != current_user.id:
+		return jsonify({"error": "Not authorized"}), 403
+
+	def events():
+		if not Chapter.query.filter_by(session_id=session_id, number=number).first():
+			with single_flight.claim(session_id, number) as leader:
+				if leader and not Chapter.query.filter_by(session_id=session_id, number=number).first():
+					for chunk in stream_chapter(session_obj, number):
+						yield f"data: {json.dumps({'text': chunk})}\n\n"
+			if not leader:
+				# A refresh while another request streams this chapter: wait for it instead of generating twice
+				single_flight.wait(session_id, number)
+		yield "event: done\ndata: {}\n\n"
+
+	return Response(
+		stream_with_context(events()),
+		mimetype="text/event-stream",
+		headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+	)
+
+
 @main_bp.post("/session/<int:session_id>/chapter/<int:number>/back")
 @login_required
 def back_chapter(session_id: int, number: int):
@@ -128,54 +212,58 @@ def back_chapter(session_id: int, number: int):
 	current = Chapter.query.filter_by(session_id=session_id, number=number).first()
 	if current:
 		db.session.delete(current)
-		db.session.commit()
+		reset_story_state(session_obj, number)
+	# A job still writing this chapter must not bring it back
+	jobs.cancel(session_id, number)
+	db.session.commit()
+	prefetch.discard(session_id, number)
 	return redirect(url_for("main.chapter", session_id=session_id, number=number - 1))
 
 
 @main_bp.post("/session/<int:session_id>/chapter/<int:number>")
 @login_required
 def choose_option(session_id: int, number: int):
+    session_obj = StorySession.query.get_or_404(session_id)
+    # 404 rather than 403: other readers' sessions are not ours to reveal
+    if session_obj.user_id != current_user.id:
+        abort(404)
     choice = (request.form.get("choice") or "").strip().upper()
     chapter = Chapter.query.filter_by(session_id=session_id, number=number).first_or_404()
     if choice not in {"A", "B", "C"}:
         flash("Please choose a valid option", "warning")
         return redirect(url_for("main.chapter", session_id=session_id, number=number))
+    if chapter.selected_choice and chapter.selected_choice != choice:
+        # Re-picking on an earlier chapter invalidates the state folded past it
+        reset_story_state(session_obj, number)
     chapter.selected_choice = choice
     db.session.commit()
+    # Persisted state lags one chapter; story_context folds this one with its choice
+    advance_story_state(session_obj, number - 1)
 
     # If final chapter, complete and show session
-    if number >= 30:
-        session_obj = StorySession.query.get(session_id)
+    if number >= Config.MAX_CHAPTERS:
         session_obj.is_complete = True
         db.session.commit()
         return redirect(url_for("main.view_session", session_id=session_id))
-    # Synchronously generate next chapter so it appears immediately after click
+    # Generate the next chapter (inline or queued) before showing it
     next_number = number + 1
     # Only generate if it doesn't exist yet
     existing = Chapter.query.filter_by(session_id=session_id, number=next_number).first()
     if not existing:
-        session_obj = StorySession.query.get_or_404(session_id)
-        prev_chapters = Chapter.query.filter_by(session_id=session_id).order_by(Chapter.number.asc()).all()
-        history = []
-        for ch in prev_chapters:
-            history.append((ch.number, ch.content[:120].replace("\n", " ") + ("..." if len(ch.content) > 120 else ""), ch.selected_choice or ""))
-        content, choices, image_url = ai_service.generate_chapter(
-            book_title=session_obj.book_title,
-            character=session_obj.selected_character or "Protagonist",
-            chapter_num=next_number,
-            history=history,
-        )
-        next_chapter = Chapter(
-            session_id=session_id,
-            number=next_number,
-            content=content,
-            choice_a=choices[0] if len(choices) > 0 else None,
-            choice_b=choices[1] if len(choices) > 1 else None,
-            choice_c=choices[2] if len(choices) > 2 else None,
-            image_url=image_url,
-        )
-        db.session.add(next_chapter)
-        db.session.commit()
+        # A finished prefetch is promoted inline; anything slower goes to the job queue
+        candidate = prefetch.take(session_id, next_number, choice, wait=False) if Config.PREFETCH_CHAPTERS else None
+        if candidate:
+            prefetch.promote(candidate)
+        elif chapter_from_tree(session_obj, next_number):
+            # another reader already took this path; copied from the story tree
+            pass
+        elif Config.STREAM_CHAPTERS:
+            # the chapter page streams it in over /stream
+            pass
+        elif Config.ASYNC_GENERATION:
+            jobs.enqueue(current_app._get_current_object(), session_id, next_number)
+        else:
+            prefetch.promote_or_create(session_obj, next_number)
     return redirect(url_for("main.chapter", session_id=session_id, number=next_number))
 
 
@@ -186,14 +274,37 @@ def view_session(session_id: int):
     if session_obj.user_id != current_user.id:
         flash("Not authorized", "danger")
         return redirect(url_for("main.index"))
-    return render_template("session.html", session=session_obj)
+    # Optional chapter-range mode: ?start=N&per=M, or SESSION_CHAPTERS_PER_PAGE by default
+    first = max(1, request.args.get("start", 1, type=int))
+    per = request.args.get("per", Config.SESSION_CHAPTERS_PER_PAGE, type=int)
+    query = Chapter.query.filter(Chapter.session_id == session_id)
+    pages = None
+    if per > 0:
+        query = query.filter(Chapter.number >= first, Chapter.number < first + per)
+        last = db.session.query(db.func.max(Chapter.number)).filter(Chapter.session_id == session_id).scalar() or 0
+        pages = {
+            "prev": url_for("main.view_session", session_id=session_id, start=max(1, first - per), per=per) if first > 1 else None,
+            "next": url_for("main.view_session", session_id=session_id, start=first + per, per=per) if first + per <= last else None,
+        }
+    # Rows are fetched in batches from a server-side cursor while the page streams
+    chapters = (
+        query.options(db.undefer(Chapter.content))
+        .order_by(Chapter.number)
+        .yield_per(Config.SESSION_STREAM_BATCH)
+    )
+    # Flashes must be popped before the headers (and session cookie) go out
+    get_flashed_messages(with_categories=True)
+    return stream_template("session.html", session=session_obj, chapters=chapters, first=first if pages else 1, pages=pages)
 
 
 @main_bp.route("/profile", methods=["GET", "POST"])
 @login_required
 def profile():
     if request.method == "GET":
-        return render_template("profile.html", user=current_user)
+        sessions, next_cursor = session_page(current_user.id, request.args.get("after"))
+        return render_template(
+            "profile.html", user=current_user, sessions=sessions, next_cursor=next_cursor, paged=bool(request.args.get("after"))
+        )
     # POST: update profile fields
     name = bleach.clean(request.form.get("name", ""), strip=True)[:255]
     favorite_book = bleach.clean(request.form.get("favorite_book", ""), strip=True)[:255]
@@ -205,11 +316,10 @@ def profile():
     file = request.files.get("profile_picture")
     if file and file.filename:
         filename = secure_filename(file.filename)
-        upload_dir = os.path.join(os.path.dirname(__file__), "static", "generated")
-        os.makedirs(upload_dir, exist_ok=True)
-        path = os.path.join(upload_dir, filename)
+        os.makedirs(image_store.STORE_DIR, exist_ok=True)
+        path = os.path.join(image_store.STORE_DIR, filename)
         file.save(path)
-        picture_url = "/static/generated/" + filename
+        picture_url = image_store.STORE_URL + filename
     # Apply updates
     changed = False
     if name and name != current_user.name:
@@ -0,0 +1,134 @@
+"""Single-flight chapter generation, keyed by ``(session_id, number)``.
+
+A double-clicked choice, or a refresh while a chapter is still being
+written, would otherwise start a second model call for the same chapter.
+The first requester inserts a ``generation_lock`` row, whose primary key is
+the chapter key, so the insert is the lock and holds across threads and
+worker processes. Everyone else waits for the chapter to appear and gets
+that same row. Waiters in the leader's own process block on an Event; waiters
+in other processes poll the lock row. A lock older than
+``JOB_TIMEOUT_SECONDS`` is taken to belong to a dead process and is broken.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Iterator
+
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .models import Chapter, GenerationLock
+from config import Config
+
+POLL_SECONDS = 0.5
+
+_lock = threading.Lock()
+_inflight: dict[tuple[int, int], threading.Event] = {}
+
+
+def _owner() -> str:
+    return f"{os.getpid()}:{threading.get_ident()}"
+
+
+def _existing(session_id: int, number: int) -> Chapter | None:
+    return Chapter.query.filter_by(session_id=session_id, number=number).first()
+
+
+def _acquire(session_id: int, number: int) -> bool:
+    stale = datetime.utcnow() - timedelta(seconds=Config.JOB_TIMEOUT_SECONDS)
+    GenerationLock.query.filter(
+        GenerationLock.session_id == session_id, GenerationLock.number == number, GenerationLock.acquired_at < stale
+    ).delete(synchronize_session=False)
+    db.session.add(GenerationLock(session_id=session_id, number=number, owner=_owner()))
+    try:
+        db.session.commit()
+        return True
+    except IntegrityError:
+        # Another process holds it
+        db.session.rollback()
+        return False
+
+
+def _release(session_id: int, number: int) -> None:
+    GenerationLock.query.filter_by(session_id=session_id, number=number, owner=_owner()).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def _held(session_id: int, number: int) -> bool:
+    return db.session.query(GenerationLock.query.filter_by(session_id=session_id, number=number).exists()).scalar()
+
+
+@contextmanager
+def claim(session_id: int, number: int) -> Iterator[bool]:
+    """Yield True if the caller is now the only one generating the chapter, else False.
+
+    The claim is released on exit, including when a streaming response is
+    closed early.
+    """
+    key = (session_id, number)
+    with _lock:
+        event = _inflight.get(key)
+        leader = event is None
+        if leader:
+            event = _inflight[key] = threading.Event()
+    if not leader:
+        yield False
+        return
+    try:
+        if not _acquire(*key):
+            yield False
+            return
+        try:
+            yield True
+        except BaseException:
+            db.session.rollback()
+            raise
+        finally:
+            _release(*key)
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+        event.set()
+
+
+def wait(session_id: int, number: int, deadline: float | None = None) -> Chapter | None:
+    """Block until the chapter exists or nobody is generating it any more; return it if it exists."""
+    key = (session_id, number)
+    if deadline is None:
+        deadline = time.monotonic() + Config.JOB_TIMEOUT_SECONDS
+    with _lock:
+        event = _inflight.get(key)
+    if event:
+        event.wait(max(0.0, deadline - time.monotonic()))
+    else:
+        while _held(*key) and not _existing(*key) and time.monotonic() < deadline:
+            # End the read transaction so the other process's commit becomes visible
+            db.session.commit()
+            time.sleep(POLL_SECONDS)
+    db.session.commit()
+    return _existing(*key)
+
+
+def run(session_id: int, number: int, produce: Callable[[], Chapter]) -> Chapter:
+    """Return chapter ``number``, calling ``produce`` only if nobody else is generating it.
+
+    Concurrent callers get the chapter saved by the one ``produce`` call. If
+    that call fails, the caller that made it gets the error and the next
+    waiter takes over.
+    """
+    deadline = time.monotonic() + Config.JOB_TIMEOUT_SECONDS
+    while True:
+        chapter = _existing(session_id, number)
+        if chapter:
+            return chapter
+        with claim(session_id, number) as leader:
+            if leader:
+                # It may have been saved between the check above and the claim
+                return _existing(session_id, number) or produce()
+        chapter = wait(session_id, number, deadline)
+        if chapter:
+            return chapter
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Chapter {number} of session {session_id} is still being generated")
@@ -0,0 +1,317 @@
+import json
+import zlib
+from array import array
+from typing import Callable, List, Tuple
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .ai_service import AIService
+from .models import Chapter, StoryNode, StorySession
+from config import Config
+
+ai_service = AIService(api_key=Config.GEMINI_API_KEY)
+
+
+class GenerationCancelled(Exception):
+    """The chapter stopped being wanted (story deleted, reader went back) while it was generated."""
+
+
+def snippet(content: str) -> str:
+    return content[:120].replace("\n", " ") + ("..." if len(content) > 120 else "")
+
+
+def pack_context(tokens: List[int]) -> bytes:
+    """Store Ollama context token ids as zlib-compressed unsigned ints."""
+    return zlib.compress(array("I", tokens).tobytes())
+
+
+def unpack_context(data: bytes) -> List[int]:
+    tokens = array("I")
+    tokens.frombytes(zlib.decompress(data))
+    return tokens.tolist()
+
+
+def fold_chapter(summary: str, facts: List[str], number: int, chapter_summary: str, choice: str, choice_text: str | None) -> Tuple[str, List[str]]:
+    """Fold one chapter into the rolling (summary, facts) state.
+
+    The summary keeps the most recent chapter lines that fit in
+    ``STORY_SUMMARY_MAX_CHARS``; facts record the reader's decisions, keeping
+    the first one plus the latest ``STORY_FACTS_MAX - 1``. Both are bounded,
+    so prompts stay the same size however long the story runs.
+    """
+    lines = summary.splitlines() if summary else []
+    lines.append(f"Chapter {number}: {chapter_summary} | Choice {choice}")
+    while len(lines) > 1 and len("\n".join(lines)) > Config.STORY_SUMMARY_MAX_CHARS:
+        lines.pop(0)
+    facts = list(facts)
+    if choice_text:
+        facts.append(f"Chapter {number}: {choice_text}")
+    if len(facts) > Config.STORY_FACTS_MAX:
+        facts = facts[:1] + facts[len(facts) - Config.STORY_FACTS_MAX + 1:]
+    return "\n".join(lines), facts
+
+
+def _chosen_text(chapter, choice: str) -> str | None:
+    return {"A": chapter.choice_a, "B": chapter.choice_b, "C": chapter.choice_c}.get(choice)
+
+
+def _folded_state(session_obj: StorySession, through: int, override: Tuple[int, str] | None = None) -> Tuple[str, List[str]]:
+    """Return the story state folded through chapter ``through``.
+
+    Starts from the persisted state when it is usable and only reads the
+    chapters after it, normally none. Only the stored summary and choice
+    columns are selected, never the chapter bodies.
+    """
+    start = session_obj.summary_through or 0
+    if start > through or (override and override[0] <= start):
+        # The reader went back past the persisted state, or a folded choice is overridden; rebuild from scratch
+        start = 0
+    summary = (session_obj.story_summary or "") if start else ""
+    facts = json.loads(session_obj.story_facts or "[]") if start else []
+    chapters = (
+        db.session.query(
+            Chapter.number, Chapter.summary, Chapter.selected_choice, Chapter.choice_a, Chapter.choice_b, Chapter.choice_c
+        )
+        .filter(Chapter.session_id == session_obj.id, Chapter.number > start, Chapter.number <= through)
+        .order_by(Chapter.number.asc())
+        .all()
+    )
+    for ch in chapters:
+        choice = ch.selected_choice or ""
+        if override and ch.number == override[0]:
+            choice = override[1]
+        summary, facts = fold_chapter(summary, facts, ch.number, ch.summary or "", choice, _chosen_text(ch, choice))
+    return summary, facts
+
+
+def story_context(session_obj: StorySession, before: int, override: Tuple[int, str] | None = None) -> dict:
+    """Prompt context for generating chapter ``before``: rolling summary, facts and the last chapter.
+
+    ``override`` replaces the selected choice of one chapter, which lets the
+    prefetcher explore a branch the reader has not picked yet. The state is
+    folded from the persisted copy through chapter ``before - 2``; chapter
+    ``before - 1`` is always re-read so its choice (or the override) is the
+    one that reaches the prompt.
+    """
+    summary, facts = _folded_state(session_obj, before - 2, override)
+    history = []
+    choice = ""
+    prev = (
+        db.session.query(Chapter.number, Chapter.summary, Chapter.selected_choice, Chapter.choice_a, Chapter.choice_b, Chapter.choice_c)
+        .filter(Chapter.session_id == session_obj.id, Chapter.number == before - 1)
+        .first()
+    )
+    if prev:
+        choice = override[1] if override and override[0] == prev.number else (prev.selected_choice or "")
+        summary, facts = fold_chapter(summary, facts, prev.number, prev.summary or "", choice, _chosen_text(prev, choice))
+        history.append((prev.number, prev.summary or "", choice))
+    llm_context = None
+    # The stored context ends with chapter before-1's text, before any choice, so it suits every
+    # branch; continuing it needs to say which option was taken
+    if session_obj.llm_context and session_obj.llm_context_through == before - 1 and choice in ("A", "B", "C"):
+        llm_context = (session_obj.llm_context_model, unpack_context(session_obj.llm_context))
+    return {"history": history, "summary": summary, "facts": facts, "llm_context": llm_context, "choice": choice}
+
+
+def advance_story_state(session_obj: StorySession, through: int) -> None:
+    """Persist the rolling state folded through chapter ``through``.
+
+    Called with the chapter before the one just chosen: ``story_context``
+    folds the latest chapter itself, so its choice can still be overridden.
+    """
+    if (session_obj.summary_through or 0) >= through:
+        return
+    summary, facts = _folded_state(session_obj, through)
+    session_obj.story_summary = summary
+    session_obj.story_facts = json.dumps(facts)
+    session_obj.summary_through = through
+    db.session.commit()
+
+
+def reset_story_state(session_obj: StorySession, before: int) -> None:
+    """Forget persisted state that covers chapter ``before`` or later (Back, or a changed choice)."""
+    if (session_obj.summary_through or 0) >= before:
+        session_obj.story_summary = None
+        session_obj.story_facts = None
+        session_obj.summary_through = 0
+    if (session_obj.llm_context_through or 0) >= before:
+        session_obj.llm_context = None
+        session_obj.llm_context_model = None
+        session_obj.llm_context_through = None
+
+
+def generate_fields(session_obj: StorySession, number: int, context: dict) -> dict:
+    """Run the AI service and return column values shared by Chapter and ChapterCandidate."""
+    draft = ai_service.generate_chapter(
+        book_title=session_obj.book_title,
+        character=session_obj.selected_character or "Protagonist",
+        chapter_num=number,
+        with_image=not Config.ASYNC_IMAGES,
+        **context,
+    )
+    return chapter_fields(*draft)
+
+
+def chapter_fields(content: str, choices: List[str], image_url: str | None, llm_context: Tuple[str, List[int]] | None = None, stub: bool = False) -> dict:
+    """Column values for a generated chapter, plus a ``stub`` flag that callers pop before saving."""
+    return {
+        "content": content,
+        "choice_a": choices[0] if len(choices) > 0 else None,
+        "choice_b": choices[1] if len(choices) > 1 else None,
+        "choice_c": choices[2] if len(choices) > 2 else None,
+        "image_url": image_url,
+        "llm_context": pack_context(llm_context[1]) if llm_context else None,
+        "llm_context_model": llm_context[0] if llm_context else None,
+        "stub": stub,
+    }
+
+
+def story_path(session_obj: StorySession, number: int, override: Tuple[int, str] | None = None) -> str | None:
+    """Choice path leading to chapter ``number`` in the shared story tree, or None if it is not shared.
+
+    The path is the selected choice of every earlier chapter (``"ABA"`` for
+    chapter 4); ``override`` replaces one of them as in ``story_context``.
+    The chapter is only shared while the previous one is the tree node for
+    the path before it; a chapter generated privately (say, before
+    ``SHARED_STORY_TREE`` was turned on, or while another session held the
+    node) takes the rest of the session off the tree. Without
+    ``SHARED_STORY_TREE`` only opening chapters are shared.
+    """
+    if number == 1:
+        return ""
+    if not Config.SHARED_STORY_TREE or number - 1 > StoryNode.path.type.length:
+        return None
+    rows = (
+        db.session.query(Chapter.number, Chapter.selected_choice, Chapter.story_node_id)
+        .filter(Chapter.session_id == session_obj.id, Chapter.number < number)
+        .all()
+    )
+    choices = {n: choice for n, choice, _ in rows}
+    if override:
+        choices[override[0]] = override[1]
+    path = [choices.get(n) for n in range(1, number)]
+    # A gap or an unchosen chapter means the session is not on a tree path
+    if not all(path):
+        return None
+    path = "".join(path)
+    parent_id = next((node_id for n, _, node_id in rows if n == number - 1), None)
+    parent = db.session.get(StoryNode, parent_id) if parent_id else None
+    return path if parent and parent.path == path[:-1] else None
+
+
+def shared_fields(session_obj: StorySession, number: int, override: Tuple[int, str] | None = None) -> dict | None:
+    """Chapter fields from the shared story-tree node for chapter ``number``, if there is one."""
+    from . import story_tree
+
+    path = story_path(session_obj, number, override)
+    if path is None or not session_obj.selected_character:
+        return None
+    node = story_tree.lookup(session_obj.book_title, session_obj.selected_character, path)
+    if not node:
+        return None
+    story_tree.count(hit=True)
+    story_tree.record_hit(node)
+    return story_tree.node_fields(node)
+
+
+def share_chapter(
+    session_obj: StorySession, number: int, fields: dict, override: Tuple[int, str] | None = None
+) -> int | None:
+    """Store freshly generated chapter ``fields`` as the story-tree node for its path.
+
+    Returns the new node's id, or None if the chapter was not stored.
+    """
+    from . import story_tree
+
+    path = story_path(session_obj, number, override)
+    if path is None or not session_obj.selected_character or fields.get("stub"):
+        return None
+    # Counted here rather than on lookup: a chapter may be looked up several times before it is generated
+    story_tree.count(hit=False)
+    return story_tree.store(
+        session_obj.book_title, session_obj.selected_character, path, fields, summary=snippet(fields["content"])
+    )
+
+
+def chapter_from_tree(session_obj: StorySession, number: int) -> Chapter | None:
+    """Copy the shared story-tree node for chapter ``number`` into the session, if there is one."""
+    fields = shared_fields(session_obj, number)
+    if not fields:
+        return None
+    return save_chapter(session_obj, number, fields, share=False)
+
+
+def create_chapter(session_obj: StorySession, number: int, keep: Callable[[], bool] | None = None) -> Chapter:
+    """Generate chapter ``number`` synchronously (or copy it from the story tree) and persist it.
+
+    ``keep`` is asked after generating and before saving; if it returns
+    False nothing is saved and ``GenerationCancelled`` is raised.
+    """
+    chapter = chapter_from_tree(session_obj, number)
+    if chapter:
+        return chapter
+    context = story_context(session_obj, number)
+    fields = generate_fields(session_obj, number, context)
+    if keep and not keep():
+        raise GenerationCancelled(f"Chapter {number} of session {session_obj.id} is no longer wanted")
+    return save_chapter(session_obj, number, fields)
+
+
+def save_chapter(session_obj: StorySession, number: int, fields: dict, share: bool = True) -> Chapter:
+    """Persist a chapter and, in async image mode, queue its illustration.
+
+    With ``SHARED_STORY_TREE`` the chapter is also stored in the story tree
+    unless ``share`` is false (it was copied from there).
+    """
+    from . import images, prefetch
+
+    fields = dict(fields)
+    stub = fields.pop("stub", False)
+    llm_context = fields.pop("llm_context", None)
+    llm_context_model = fields.pop("llm_context_model", None)
+    chapter = Chapter(session_id=session_obj.id, number=number, summary=snippet(fields["content"]), **fields)
+    if llm_context:
+        session_obj.llm_context = llm_context
+        session_obj.llm_context_model = llm_context_model
+        session_obj.llm_context_through = number
+    if Config.ASYNC_IMAGES and not chapter.image_url and not stub:
+        chapter.image_status = "pending"
+    db.session.add(chapter)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent worker saved this chapter first (uq_chapter_session_number); keep theirs
+        db.session.rollback()
+        return Chapter.query.filter_by(session_id=session_obj.id, number=number).one()
+    # Candidates for the next chapter were written from whatever this chapter replaced
+    prefetch.discard(session_obj.id, number + 1)
+    if chapter.image_status == "pending":
+        images.enqueue(current_app._get_current_object(), chapter.id)
+    if share and not stub and Config.SHARED_STORY_TREE:
+        chapter.story_node_id = share_chapter(session_obj, number, fields)
+        if chapter.story_node_id:
+            db.session.commit()
+    return chapter
+
+
+def stream_chapter(session_obj: StorySession, number: int):
+    """Yield text chunks for chapter ``number`` and persist the parsed chapter at the end."""
+    kwargs = dict(
+        book_title=session_obj.book_title,
+        character=session_obj.selected_character or "Protagonist",
+        chapter_num=number,
+    )
+    context = story_context(session_obj, number)
+    result: dict = {}
+    parts: List[str] = []
+    for chunk in ai_service.stream_chapter(**kwargs, **context, result=result):
+        parts.append(chunk)
+        yield chunk
+    draft = ai_service.complete_chapter(
+        "".join(parts), history=context["history"], with_image=not Config.ASYNC_IMAGES, **kwargs
+    )
+    # A concurrent request may have finished the same chapter first
+    if not Chapter.query.filter_by(session_id=session_obj.id, number=number).first():
+        save_chapter(session_obj, number, chapter_fields(*draft._replace(llm_context=result.get("context"))))
@@ -0,0 +1,92 @@
+"""Chapters shared across sessions, keyed by book, character and choice path.
+
+A ``StoryNode`` holds the chapter reached in a book as a character by a
+given sequence of choices; the opening chapter has the empty path. Nodes
+are copied into a session's own ``Chapter`` rows on read, so sessions never
+share mutable state. Each such row records its node in ``story_node_id``; a
+session only reads or writes the node for a path while its previous chapter
+is the node for the path so far, so a privately generated chapter never has
+tree chapters hung under it. ``flask pregenerate`` fills the opening nodes of
+popular books ahead of time; with ``SHARED_STORY_TREE`` every generated
+chapter is stored as the node for its path.
+
+Copies and generated chapters are counted per process for ``stats()``;
+``StoryNode.hits`` keeps the all-time copy count per node.
+"""
+import threading
+
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .character_cache import normalize_title
+from .models import StoryNode
+
+_counts = {"hits": 0, "misses": 0}
+_counts_lock = threading.Lock()
+
+
+def node_key(book_title: str, character: str, path: str) -> tuple[str, str, str]:
+    return normalize_title(book_title), (character or "").strip().casefold()[:255], path
+
+
+def lookup(book_title: str, character: str, path: str) -> StoryNode | None:
+    book_key, character_key, path = node_key(book_title, character, path)
+    return StoryNode.query.filter_by(book_key=book_key, character_key=character_key, path=path).first()
+
+
+def node_fields(node: StoryNode) -> dict:
+    """Chapter column values copied out of ``node``."""
+    return {
+        "content": node.content,
+        "choice_a": node.choice_a,
+        "choice_b": node.choice_b,
+        "choice_c": node.choice_c,
+        "image_url": node.image_url,
+        "story_node_id": node.id,
+    }
+
+
+def store(book_title: str, character: str, path: str, fields: dict, summary: str | None = None) -> int | None:
+    """Save a generated chapter as the node for ``path`` unless one exists already.
+
+    Returns the new node's id, or None if another chapter holds that path.
+    """
+    book_key, character_key, path = node_key(book_title, character, path)
+    if StoryNode.query.filter_by(book_key=book_key, character_key=character_key, path=path).first():
+        return None
+    node = StoryNode(
+        book_key=book_key,
+        character_key=character_key,
+        path=path,
+        summary=summary,
+        **{k: fields[k] for k in ("content", "choice_a", "choice_b", "choice_c", "image_url")},
+    )
+    db.session.add(node)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another worker stored the same node first; theirs is just as good for other readers
+        db.session.rollback()
+        return None
+    return node.id
+
+
+def record_hit(node: StoryNode) -> None:
+    StoryNode.query.filter_by(id=node.id).update({"hits": StoryNode.hits + 1}, synchronize_session=False)
+
+
+def count(hit: bool) -> None:
+    with _counts_lock:
+        _counts["hits" if hit else "misses"] += 1
+
+
+def stats() -> dict:
+    """Hit rate of this process's lookups plus node and hit totals from the database."""
+    with _counts_lock:
+        hits, misses = _counts["hits"], _counts["misses"]
+    nodes, total_hits = db.session.query(db.func.count(StoryNode.id), db.func.coalesce(db.func.sum(StoryNode.hits), 0)).one()
+    return {
+        "process": {"hits": hits, "misses": misses, "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None},
+        "nodes": nodes,
+        "node_hits": int(total_hits),
+    }
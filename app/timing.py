@@ -0,0 +1,179 @@
+"""Per-request time breakdown in a ``Server-Timing`` header, plus sampled profiles.
+
+Time spent in the LLM, Stable Diffusion, SQL and Jinja rendering is summed
+into ``g`` while a request runs and sent as
+``Server-Timing: llm;dur=..., sd;dur=..., db;dur=..., render;dur=..., total;dur=...``,
+which browser dev tools show next to the request. Backend calls report
+through ``add`` (see ``metrics.ai_call``); calls made outside a request,
+such as background jobs, are ignored. Hedged attempts running in parallel
+are summed, so ``llm`` can exceed ``total``. Templates streamed with
+``stream_template`` render after the headers are sent, so they are not
+counted.
+
+With ``PROFILE_SAMPLE_RATE`` above 0, that fraction of requests runs under
+a profiler. Any of those slower than ``PROFILE_SLOW_MS`` is written to
+``PROFILE_DIR``: cProfile ``.prof`` files (open with ``snakeviz`` or
+``pstats``), or pyinstrument ``.html`` if ``PROFILER=pyinstrument`` and it
+is installed.
+"""
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+from flask import Flask, g, has_request_context, request
+
+from config import Config
+
+PHASES = ("llm", "sd", "db", "render")
+
+# Hedged attempts add from executor threads that share the request's g
+_lock = threading.Lock()
+
+
+def add(phase: str, seconds: float) -> None:
+    """Add ``seconds`` to ``phase`` of the current request, if there is one."""
+    if not has_request_context():
+        return
+    timings = g.get("server_timing")
+    if timings is None:
+        return
+    with _lock:
+        timings[phase] = timings.get(phase, 0.0) + seconds
+        timings[f"{phase}_count"] = timings.get(f"{phase}_count", 0) + 1
+
+
+def header(timings: dict, total: float) -> str:
+    parts = []
+    for phase in PHASES:
+        if phase in timings:
+            # desc shows as the label in dev tools; the call count tells N+1 queries apart from one slow one
+            parts.append(f'{phase};desc="{phase} x{timings[phase + "_count"]}";dur={timings[phase] * 1000:.1f}')
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+class _Profiler:
+    """cProfile, or pyinstrument when selected and installed."""
+
+    def __init__(self):
+        self.kind = "cprofile"
+        if Config.PROFILER == "pyinstrument":
+            try:
+                from pyinstrument import Profiler
+
+                self.kind = "pyinstrument"
+                self.profiler = Profiler()
+            except ImportError:
+                pass
+        if self.kind == "cprofile":
+            import cProfile
+
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            self.profiler.start()
+
+    def stop(self) -> None:
+        if self.kind == "cprofile":
+            self.profiler.disable()
+        else:
+            self.profiler.stop()
+
+    def dump(self, name: str) -> str:
+        os.makedirs(Config.PROFILE_DIR, exist_ok=True)
+        if self.kind == "cprofile":
+            path = os.path.join(Config.PROFILE_DIR, f"{name}.prof")
+            self.profiler.dump_stats(path)
+        else:
+            path = os.path.join(Config.PROFILE_DIR, f"{name}.html")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self.profiler.output_html())
+        return path
+
+
+def _start_profile() -> None:
+    try:
+        g.profiler = _Profiler()
+    except ValueError:
+        # Only one profiler can be active per thread (or per process on Python 3.12+)
+        g.profiler = None
+
+
+def _finish_profile(elapsed: float, status: int) -> None:
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return
+    profiler.stop()
+    if elapsed * 1000 < Config.PROFILE_SLOW_MS:
+        return
+    stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+    name = f"{stamp}-{request.endpoint or 'unmatched'}-{status}-{elapsed * 1000:.0f}ms"
+    try:
+        path = profiler.dump(name)
+        print(f"Profiled slow request {request.method} {request.path} ({elapsed:.1f}s): {path}")
+    except OSError as e:
+        print(f"Writing profile {name} failed: {e}")
+
+
+def init_app(app: Flask) -> None:
+    """Record SQL and render spans, emit Server-Timing and take sampled profiles."""
+    from flask import before_render_template, template_rendered
+    from sqlalchemy import event
+
+    from . import db
+
+    def before_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("timing_start", []).append(time.perf_counter())
+
+    def after_query(conn, cursor, statement, parameters, context, executemany):
+        add("db", time.perf_counter() - conn.info["timing_start"].pop())
+
+    def failed_query(exception_context):
+        starts = exception_context.connection.info.get("timing_start") if exception_context.connection else None
+        if starts:
+            starts.pop()
+
+    def render_started(sender, template, context, **extra):
+        g.render_start = time.perf_counter()
+
+    def render_finished(sender, template, context, **extra):
+        start = g.pop("render_start", None)
+        if start is not None:
+            add("render", time.perf_counter() - start)
+
+    if Config.SERVER_TIMING:
+        with app.app_context():
+            event.listen(db.engine, "before_cursor_execute", before_query)
+            event.listen(db.engine, "after_cursor_execute", after_query)
+            event.listen(db.engine, "handle_error", failed_query)
+        # Strong references: the receivers are local functions
+        before_render_template.connect(render_started, app, weak=False)
+        template_rendered.connect(render_finished, app, weak=False)
+
+    @app.before_request
+    def start_timing():
+        if Config.SERVER_TIMING:
+            g.server_timing = {}
+        g.server_timing_start = time.perf_counter()
+        if Config.PROFILE_SAMPLE_RATE > 0 and random.random() < Config.PROFILE_SAMPLE_RATE:
+            _start_profile()
+
+    @app.after_request
+    def emit_timing(response):
+        start = g.pop("server_timing_start", None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        if Config.SERVER_TIMING:
+            response.headers["Server-Timing"] = header(g.pop("server_timing", {}), elapsed)
+        _finish_profile(elapsed, response.status_code)
+        return response
+
+    @app.teardown_request
+    def stop_profile(exc):
+        # after_request is skipped when the view raised
+        profiler = g.pop("profiler", None)
+        if profiler is not None:
+            profiler.stop()
@@ -0,0 +1,88 @@
+"""Shared keep-alive HTTP transport for the local model servers.
+
+Each backend (Ollama, Stable Diffusion, ComfyUI) gets its own
+``requests.Session`` with a connection pool sized for it, and one pool per
+host the backend talks to (the Ollama hedge hosts share its session), so
+concurrent requests reuse sockets instead of opening a new TCP connection
+per call.
+Connection failures are retried a bounded number of times with jittered
+exponential backoff; read timeouts are never retried because the server
+may still be working on the request. POSTs (generation, txt2img) are only
+retried when the connection was never established, since a connection
+dropped after the body was sent may have left the server generating.
+"""
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from config import Config
+
+
+IDEMPOTENT = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+
+def _never_connected(exc: requests.ConnectionError) -> bool:
+    """Whether ``exc`` happened before a connection existed, so no request reached the server."""
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    # requests wraps urllib3's MaxRetryError, whose reason is the underlying error
+    reason = getattr(exc.args[0], "reason", None) if exc.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class HTTPTransport:
+    def __init__(self, pool_sizes: dict[str, int] | None = None):
+        self.pool_sizes = pool_sizes or {
+            "ollama": Config.OLLAMA_POOL_SIZE,
+            "sd": Config.SD_POOL_SIZE,
+            "comfyui": Config.SD_POOL_SIZE,
+        }
+        # Hosts per backend: with fewer host pools than hosts, hosts evict each other's keep-alive pool
+        self.hosts = {"ollama": 1 + len(Config.OLLAMA_HEDGE_URLS)}
+        self.connect_timeout = Config.HTTP_CONNECT_TIMEOUT
+        self.retries = Config.HTTP_RETRIES
+        self.backoff = Config.HTTP_BACKOFF
+        self._sessions: dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+
+    def session(self, backend: str) -> requests.Session:
+        with self._lock:
+            sess = self._sessions.get(backend)
+            if sess is None:
+                size = self.pool_sizes.get(backend, 4)
+                adapter = HTTPAdapter(pool_connections=self.hosts.get(backend, 1), pool_maxsize=size)
+                sess = requests.Session()
+                sess.mount("http://", adapter)
+                sess.mount("https://", adapter)
+                self._sessions[backend] = sess
+            return sess
+
+    def request(self, method: str, backend: str, url: str, read_timeout: float, **kwargs) -> requests.Response:
+        """Send through the ``backend`` pool with (connect, read) timeouts and connect retries."""
+        sess = self.session(backend)
+        attempt = 0
+        while True:
+            try:
+                return sess.request(method, url, timeout=(self.connect_timeout, read_timeout), **kwargs)
+            except requests.ConnectionError as e:
+                if attempt >= self.retries or (method.upper() not in IDEMPOTENT and not _never_connected(e)):
+                    raise
+                # Full-range jitter keeps workers from retrying in lockstep
+                time.sleep(self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+                attempt += 1
+
+    def post(self, backend: str, url: str, read_timeout: float, **kwargs) -> requests.Response:
+        return self.request("POST", backend, url, read_timeout, **kwargs)
+
+    def get(self, backend: str, url: str, read_timeout: float, **kwargs) -> requests.Response:
+        return self.request("GET", backend, url, read_timeout, **kwargs)
+
+    def close(self) -> None:
+        with self._lock:
+            for sess in self._sessions.values():
+                sess.close()
+            self._sessions.clear()
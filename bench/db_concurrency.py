@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Database concurrency benchmark.
+
+Runs several worker processes against one database, each doing a mix of
+chapter writes (insert a chapter and update its session, as a generation
+job does) and chapter-page reads. For SQLite it compares the stock
+rollback-journal setup (SQLITE_TUNING=0) with the tuned engine (WAL,
+synchronous=NORMAL, busy_timeout, mmap) on fresh database files. For any other
+DATABASE_URL it runs once with the configured pool options.
+
+    python bench/db_concurrency.py                    # SQLite, baseline vs tuned
+    python bench/db_concurrency.py --workers 16 --ops 500 --write-ratio 0.5
+    DATABASE_URL=postgresql+psycopg://... python bench/db_concurrency.py
+    python bench/db_concurrency.py --json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CONTENT = "You step into the castle. The door slams behind you. " * 20
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def worker(worker_id: int, ops: int, write_ratio: float, barrier, queue) -> None:
+    from app import create_app, db
+    from app.models import Chapter, StorySession
+
+    app = create_app()
+    reads, writes, errors = [], [], 0
+    rng = random.Random(worker_id)
+    with app.app_context():
+        session_obj = StorySession(user_id=1, book_title=f"Bench {worker_id}", selected_character="Mina")
+        db.session.add(session_obj)
+        db.session.commit()
+        session_id = session_obj.id
+        number = 0
+        # Start the clock only once every worker has paid its startup cost
+        barrier.wait()
+        began = time.time()
+        for _ in range(ops):
+            start = time.perf_counter()
+            try:
+                if number == 0 or rng.random() < write_ratio:
+                    number += 1
+                    db.session.add(Chapter(session_id=session_id, number=number, content=CONTENT, summary=CONTENT[:120]))
+                    db.session.get(StorySession, session_id).summary_through = number
+                    db.session.commit()
+                    writes.append(time.perf_counter() - start)
+                else:
+                    Chapter.query.filter_by(session_id=session_id, number=rng.randint(1, number)).options(
+                        db.undefer(Chapter.content)
+                    ).first()
+                    db.session.commit()
+                    reads.append(time.perf_counter() - start)
+            except Exception:
+                db.session.rollback()
+                errors += 1
+                if number and not Chapter.query.filter_by(session_id=session_id, number=number).first():
+                    number -= 1
+        ended = time.time()
+    queue.put({"reads": reads, "writes": writes, "errors": errors, "began": began, "ended": ended})
+
+
+def run_mode(args) -> dict:
+    """Child process: migrate, run the workers and return the summary (env already set)."""
+    from flask_migrate import Migrate, upgrade
+
+    from app import create_app, db
+    from app.models import User
+
+    app = create_app()
+    Migrate(app, db)
+    with app.app_context():
+        upgrade(directory=os.path.join(ROOT, "migrations"))
+        if not db.session.get(User, 1):
+            db.session.add(User(id=1, email="bench@example.com"))
+            db.session.commit()
+        journal = db.session.execute(db.text("PRAGMA journal_mode")).scalar() if db.engine.dialect.name == "sqlite" else None
+        db.engine.dispose()
+
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    barrier = ctx.Barrier(args.workers)
+    procs = [ctx.Process(target=worker, args=(i, args.ops, args.write_ratio, barrier, queue)) for i in range(args.workers)]
+    for p in procs:
+        p.start()
+    results = [queue.get() for _ in procs]
+    for p in procs:
+        p.join()
+    elapsed = max(res["ended"] for res in results) - min(res["began"] for res in results)
+
+    reads = [r * 1000 for res in results for r in res["reads"]]
+    writes = [w * 1000 for res in results for w in res["writes"]]
+    errors = sum(res["errors"] for res in results)
+    return {
+        "journal_mode": journal,
+        "seconds": round(elapsed, 2),
+        "ops_per_second": round((len(reads) + len(writes)) / elapsed, 1),
+        "errors": errors,
+        "read_ms": {f"p{p}": round(percentile(reads, p), 2) for p in (50, 95, 99)},
+        "write_ms": {f"p{p}": round(percentile(writes, p), 2) for p in (50, 95, 99)},
+    }
+
+
+def spawn_mode(label: str, env: dict, argv: list[str]) -> dict:
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", *argv],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr[-2000:])
+        raise SystemExit(f"{label} run failed (exit {proc.returncode})")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["mode"] = label
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=200, help="operations per worker")
+    parser.add_argument("--write-ratio", type=float, default=0.3)
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_mode(args)))
+        return 0
+
+    argv = ["--workers", str(args.workers), "--ops", str(args.ops), "--write-ratio", str(args.write_ratio)]
+    # Keep AI backends out of the picture; only the database is measured
+    base_env = dict(os.environ, AI_PROVIDER="stub", ASYNC_GENERATION="0", PREFETCH_CHAPTERS="0")
+    url = os.getenv("DATABASE_URL")
+    runs = []
+    if url and not url.startswith("sqlite"):
+        runs.append(spawn_mode("configured", base_env, argv))
+    else:
+        for label, tuning in (("baseline", "0"), ("tuned", "1")):
+            # A fresh file per mode: WAL is persistent once enabled
+            path = os.path.join(tempfile.mkdtemp(), "bench.db")
+            runs.append(spawn_mode(label, dict(base_env, DATABASE_URL=f"sqlite:///{path}", SQLITE_TUNING=tuning), argv))
+
+    if args.json:
+        print(json.dumps(runs, indent=2))
+        return 0
+    print(f"workers={args.workers} ops/worker={args.ops} write_ratio={args.write_ratio}")
+    for r in runs:
+        journal = f" journal={r['journal_mode']}" if r["journal_mode"] else ""
+        print(
+            f"{r['mode']:>10}{journal}: {r['ops_per_second']:8.1f} ops/s  errors={r['errors']}  "
+            f"read p50/p95/p99 {'/'.join(str(v) for v in r['read_ms'].values())} ms  "
+            f"write p50/p95/p99 {'/'.join(str(v) for v in r['write_ms'].values())} ms"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
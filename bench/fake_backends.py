@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Stand-in Ollama and Stable Diffusion servers for load tests.
+
+Serves ``/api/generate`` (streaming NDJSON or one JSON object, as asked for
+by the request's ``stream`` field), ``/api/tags``, ``/sdapi/v1/txt2img`` and
+``/sdapi/v1/sd-models`` on one port, with configurable latency and failure
+rate, so a load test measures the app rather than a GPU. Character prompts
+get five names; everything else gets a chapter with three numbered options.
+
+    python bench/fake_backends.py --port 11434                   # point OLLAMA_BASE_URL and SD_BASE_URL here
+    python bench/fake_backends.py --llm-latency-ms 2000 --failure-rate 0.05
+    python bench/fake_backends.py --chunk-ms 50                   # slower token stream
+"""
+import argparse
+import base64
+import json
+import random
+import struct
+import sys
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+NAMES = ["Mina Harker", "Jonathan Harker", "Abraham Van Helsing", "Lucy Westenra", "Count Dracula"]
+CHAPTER = (
+    "The corridor narrows and the torchlight gutters as {who} presses on.\n"
+    "Somewhere below, a door that should be locked swings open on its own.\n"
+    "A cold draught carries the smell of rain and old iron up the stairs.\n"
+    "1. Follow the draught down the stairs\n"
+    "2. Bar the door and wait for morning\n"
+    "3. Call out to whoever opened it\n"
+)
+
+
+def png(width: int = 64, height: int = 64) -> bytes:
+    """A solid-colour PNG; the colour is random so the content-addressed image store does not dedupe it."""
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    pixel = bytes(random.randrange(256) for _ in range(3))
+    rows = b"".join(b"\x00" + pixel * width for _ in range(height))
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b"")
+
+
+def make_handler(args: argparse.Namespace) -> type:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *a):
+            pass
+
+        def _json(self, status: int, payload: dict) -> None:
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _delay(self, ms: float) -> None:
+            time.sleep(max(0.0, ms + random.uniform(-args.jitter_ms, args.jitter_ms)) / 1000)
+
+        def _failed(self) -> bool:
+            if random.random() >= args.failure_rate:
+                return False
+            self._json(500, {"error": "injected failure"})
+            return True
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                self._json(200, {"models": [{"name": "fake"}]})
+            elif self.path == "/sdapi/v1/sd-models":
+                self._json(200, [{"title": "fake"}])
+            else:
+                self._json(404, {"error": "not found"})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            if self.path == "/api/generate":
+                self.generate(body)
+            elif self.path == "/sdapi/v1/txt2img":
+                self._delay(args.sd_latency_ms)
+                if not self._failed():
+                    self._json(200, {"images": [base64.b64encode(png()).decode()]})
+            else:
+                self._json(404, {"error": "not found"})
+
+        def generate(self, body: dict) -> None:
+            prompt = body.get("prompt") or ""
+            if "JSON array" in prompt:
+                text = json.dumps(NAMES)
+            elif "main characters" in prompt:
+                text = ", ".join(NAMES)
+            else:
+                text = CHAPTER.format(who=random.choice(NAMES))
+            # The KV context grows with the conversation, as a real server's does
+            context = (body.get("context") or []) + list(range(len(prompt.split()) + len(text.split())))
+            stats = {"prompt_eval_count": len(prompt.split()), "eval_count": len(text.split())}
+            # Latency to the first token; the rest arrives at chunk_ms per word
+            self._delay(args.llm_latency_ms)
+            if self._failed():
+                return
+            if not body.get("stream"):
+                time.sleep(args.chunk_ms * len(text.split()) / 1000)
+                self._json(200, {"model": body.get("model"), "response": text, "done": True, "context": context, **stats})
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for word in text.split(" "):
+                    self._write_chunk({"model": body.get("model"), "response": word + " ", "done": False})
+                    time.sleep(args.chunk_ms / 1000)
+                self._write_chunk({"model": body.get("model"), "response": "", "done": True, "context": context, **stats})
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # A hedged or cancelled caller hung up
+                self.close_connection = True
+
+        def _write_chunk(self, payload: dict) -> None:
+            line = (json.dumps(payload) + "\n").encode()
+            self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--llm-latency-ms", type=float, default=500, help="delay before the first token")
+    parser.add_argument("--chunk-ms", type=float, default=5, help="delay per generated word")
+    parser.add_argument("--sd-latency-ms", type=float, default=1000, help="delay per txt2img call")
+    parser.add_argument("--jitter-ms", type=float, default=100, help="+/- random spread on each delay")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of calls answered with HTTP 500")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args))
+    server.daemon_threads = True
+    print(f"Fake Ollama and Stable Diffusion on http://{args.host}:{server.server_port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test: virtual readers play whole stories against gunicorn.
+
+Starts bench/fake_backends.py as the Ollama and Stable Diffusion servers,
+migrates a fresh SQLite database and serves the app with gunicorn. Each
+virtual user then signs up, starts a book, picks a character and reads
+``--chapters`` chapters, choosing a random option each time. Chapters that
+are not ready yet are waited for the way the browser does: by polling
+``/status`` (ASYNC_GENERATION) or reading ``/stream`` (STREAM_CHAPTERS).
+Redirects are followed by hand so every hop is timed under its own route.
+Reports p50/p95/p99 latency per route and overall throughput.
+
+    python bench/load_test.py                          # 4 users x 30 chapters, async generation
+    python bench/load_test.py --users 16 --mode inline --workers 4 --threads 8
+    python bench/load_test.py --mode stream --llm-latency-ms 1500 --chunk-ms 20
+    python bench/load_test.py --env PREFETCH_CHAPTERS=1 --env SHARED_STORY_TREE=1
+    python bench/load_test.py --server flask           # werkzeug dev server, when gunicorn is missing
+    python bench/load_test.py --json
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.fake_backends import add_arguments as add_backend_arguments  # noqa: E402
+
+TITLES = ["Dracula", "Frankenstein", "Moby-Dick", "Jane Eyre", "The Time Machine", "Treasure Island"]
+CHARACTER = re.compile(r'name="character" value="([^"]+)"')
+ROUTES = [(re.compile(r"/session/\d+"), "/session/<id>"), (re.compile(r"/chapter/\d+"), "/chapter/<n>")]
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def route(method: str, path: str) -> str:
+    path = path.split("?", 1)[0]
+    for pattern, label in ROUTES:
+        path = pattern.sub(label, path)
+    return f"{method} {path}"
+
+
+class Recorder:
+    """Latencies and error counts per route, shared by the virtual users."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+        self.chapters = 0
+
+    def add(self, label: str, seconds: float, ok: bool) -> None:
+        with self.lock:
+            self.latencies.setdefault(label, []).append(seconds)
+            if not ok:
+                self.errors[label] = self.errors.get(label, 0) + 1
+
+
+class VirtualUser:
+    def __init__(self, n: int, base: str, args: argparse.Namespace, recorder: Recorder):
+        self.n = n
+        self.base = base
+        self.args = args
+        self.recorder = recorder
+        self.http = requests.Session()
+        self.rng = random.Random(n)
+
+    def call(self, method: str, path: str, data: dict | None = None) -> requests.Response:
+        """Send one request and follow its redirects, timing each hop separately."""
+        while True:
+            start = time.perf_counter()
+            resp = self.http.request(method, self.base + path, data=data, allow_redirects=False, timeout=self.args.timeout)
+            self.recorder.add(route(method, path), time.perf_counter() - start, resp.status_code < 400)
+            if not resp.is_redirect:
+                resp.raise_for_status()
+                return resp
+            method, data = "GET", None
+            path = resp.headers["Location"].removeprefix(self.base)
+
+    def wait_for(self, chapter_path: str) -> None:
+        deadline = time.monotonic() + self.args.timeout
+        if self.args.mode == "stream":
+            start = time.perf_counter()
+            label = route("GET", chapter_path + "/stream")
+            with self.http.get(self.base + chapter_path + "/stream", stream=True, timeout=self.args.timeout) as resp:
+                first = None
+                for line in resp.iter_lines():
+                    if first is None:
+                        first = time.perf_counter() - start
+                        self.recorder.add(label + " (first event)", first, resp.ok)
+                    if line == b"event: done":
+                        break
+            self.recorder.add(label, time.perf_counter() - start, resp.ok)
+            return
+        while time.monotonic() < deadline:
+            status = self.call("GET", chapter_path + "/status").json()
+            if status.get("ready"):
+                return
+            if status.get("status") in ("failed", "missing"):
+                raise RuntimeError(f"{chapter_path}: generation {status.get('status')} {status.get('error') or ''}".strip())
+            time.sleep(self.args.poll_ms / 1000)
+        raise TimeoutError(f"{chapter_path} not ready after {self.args.timeout}s")
+
+    def run(self) -> None:
+        email = f"reader{self.n}-{os.getpid()}-{int(time.time())}@example.com"
+        self.call("POST", "/auth/signup", {"name": f"Reader {self.n}", "email": email, "password": "load-test"})
+        page = self.call("POST", "/start", {"book_title": TITLES[self.n % len(TITLES)]})
+        session_path = page.url.removeprefix(self.base).rsplit("/characters", 1)[0]
+        characters = CHARACTER.findall(page.text)
+        if not characters:
+            raise RuntimeError("no characters offered")
+        page = self.call("POST", session_path + "/characters", {"character": self.rng.choice(characters)})
+        for number in range(1, self.args.chapters + 1):
+            chapter_path = f"{session_path}/chapter/{number}"
+            if 'name="choice"' not in page.text:
+                self.wait_for(chapter_path)
+                page = self.call("GET", chapter_path)
+            with self.recorder.lock:
+                self.recorder.chapters += 1
+            # The last choice completes the story and lands on the session page
+            page = self.call("POST", chapter_path, {"choice": self.rng.choice("ABC")})
+
+
+def start_backends(args: argparse.Namespace, workdir: str) -> tuple[subprocess.Popen, str]:
+    port = free_port()
+    argv = [
+        "--port", str(port),
+        "--llm-latency-ms", str(args.llm_latency_ms),
+        "--chunk-ms", str(args.chunk_ms),
+        "--sd-latency-ms", str(args.sd_latency_ms),
+        "--jitter-ms", str(args.jitter_ms),
+        "--failure-rate", str(args.failure_rate),
+    ]
+    log = open(os.path.join(workdir, "backends.log"), "w")
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "bench", "fake_backends.py"), *argv], cwd=ROOT, stdout=log, stderr=subprocess.STDOUT
+    )
+    return proc, f"http://127.0.0.1:{port}"
+
+
+def start_app(args: argparse.Namespace, env: dict, workdir: str) -> tuple[subprocess.Popen, str]:
+    migrate = subprocess.run(
+        [sys.executable, "-m", "flask", "--app", "run.py", "db", "upgrade"], cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    if migrate.returncode != 0:
+        sys.stderr.write(migrate.stderr[-2000:])
+        raise SystemExit(f"migration failed (exit {migrate.returncode})")
+    port = free_port()
+    if args.server == "gunicorn":
+        if importlib.util.find_spec("gunicorn") is None:
+            raise SystemExit("gunicorn is not installed (pip install -r requirements.txt), or pass --server flask")
+        cmd = [
+            sys.executable, "-m", "gunicorn", "run:app",
+            "--bind", f"127.0.0.1:{port}",
+            "--workers", str(args.workers),
+            "--threads", str(args.threads),
+            "--timeout", str(args.timeout),
+        ]
+    else:
+        cmd = [sys.executable, "run.py", "--port", str(port)]
+    log = open(os.path.join(workdir, "server.log"), "w")
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return proc, f"http://127.0.0.1:{port}"
+
+
+def wait_until_up(url: str, proc: subprocess.Popen, seconds: float = 60) -> None:
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"{url} exited during startup (exit {proc.returncode})")
+        try:
+            requests.get(url, timeout=2)
+            return
+        except (requests.ConnectionError, requests.Timeout):
+            # gunicorn accepts connections before its workers have booted
+            time.sleep(0.2)
+    raise SystemExit(f"{url} did not come up within {seconds:.0f}s")
+
+
+def run(args: argparse.Namespace, base: str) -> dict:
+    recorder = Recorder()
+    failures: list[str] = []
+
+    def user(n: int) -> None:
+        # Spread arrivals so users do not hit every route in lockstep
+        time.sleep(args.ramp_seconds * n / max(1, args.users))
+        try:
+            VirtualUser(n, base, args, recorder).run()
+        except Exception as e:
+            failures.append(f"user {n}: {e}")
+
+    began = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(n,)) for n in range(args.users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - began
+
+    requests_total = sum(len(v) for v in recorder.latencies.values())
+    return {
+        "users": args.users,
+        "chapters_per_user": args.chapters,
+        "mode": args.mode,
+        "server": args.server,
+        "seconds": round(elapsed, 2),
+        "requests": requests_total,
+        "requests_per_second": round(requests_total / elapsed, 2),
+        "chapters": recorder.chapters,
+        "chapters_per_second": round(recorder.chapters / elapsed, 2),
+        "failed_users": failures,
+        "routes": {
+            label: {
+                "count": len(values),
+                "errors": recorder.errors.get(label, 0),
+                **{f"p{p}": round(percentile(values, p) * 1000, 1) for p in (50, 95, 99)},
+                "max": round(max(values) * 1000, 1),
+            }
+            for label, values in sorted(recorder.latencies.items())
+        },
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=4, help="concurrent virtual users")
+    parser.add_argument("--chapters", type=int, default=30, help="chapters each user reads")
+    parser.add_argument("--mode", choices=("async", "inline", "stream"), default="async", help="how chapters are generated")
+    parser.add_argument("--server", choices=("gunicorn", "flask"), default="gunicorn")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--threads", type=int, default=8, help="gunicorn threads per worker")
+    parser.add_argument("--ramp-seconds", type=float, default=2.0, help="spread user arrivals over this long")
+    parser.add_argument("--poll-ms", type=float, default=500, help="/status polling interval")
+    parser.add_argument("--timeout", type=int, default=300, help="per-request and per-chapter timeout, seconds")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra app setting, repeatable")
+    add_backend_arguments(parser)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="load-test-")
+    backends, backend_url = start_backends(args, workdir)
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'load.db')}",
+        AI_PROVIDER="ollama",
+        OLLAMA_BASE_URL=backend_url,
+        SD_BASE_URL=backend_url,
+        COMFYUI_BASE_URL="",
+        MAX_CHAPTERS=str(args.chapters),
+        ASYNC_GENERATION="1" if args.mode == "async" else "0",
+        STREAM_CHAPTERS="1" if args.mode == "stream" else "0",
+        PROFILE_DIR=os.path.join(workdir, "profiles"),
+        IMAGE_STORE_DIR=os.path.join(workdir, "generated"),
+    )
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    app = None
+    try:
+        wait_until_up(backend_url + "/api/tags", backends)
+        app, base = start_app(args, env, workdir)
+        wait_until_up(base + "/", app)
+        result = run(args, base)
+    finally:
+        for proc in (app, backends):
+            if proc is not None:
+                proc.terminate()
+                proc.wait()
+    result["logs"] = workdir
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return 1 if result["failed_users"] else 0
+    print(
+        f"{result['users']} users x {result['chapters_per_user']} chapters, mode={result['mode']} server={result['server']}: "
+        f"{result['seconds']}s, {result['requests_per_second']} req/s, {result['chapters_per_second']} chapters/s"
+    )
+    width = max(len(label) for label in result["routes"])
+    print(f"{'route':<{width}}  {'count':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for label, r in result["routes"].items():
+        print(f"{label:<{width}}  {r['count']:>6} {r['errors']:>6} {r['p50']:>9} {r['p95']:>9} {r['p99']:>9} {r['max']:>9}")
+    for failure in result["failed_users"]:
+        print(f"FAILED {failure}")
+    print(f"App and backend logs: {result['logs']}")
+    return 1 if result["failed_users"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
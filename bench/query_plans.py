@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Query-plan check for the hot lookups.
+
+Runs EXPLAIN for the queries behind every chapter view and the index page
+and fails (exit code 1) unless each one is served by its index without a
+table scan or a separate sort step. Works on SQLite and Postgres.
+
+    python bench/query_plans.py                       # fresh SQLite DB built from migrations
+    DATABASE_URL=postgresql+psycopg://... python bench/query_plans.py --no-migrate
+    python bench/query_plans.py --verbose             # print the plans
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def hot_queries():
+    from datetime import datetime
+
+    from app.models import Chapter
+    from app.pagination import sessions_query
+
+    return [
+        (
+            "chapter by (session_id, number)",
+            Chapter.query.filter_by(session_id=1, number=1),
+            "uq_chapter_session_number",
+        ),
+        (
+            "sessions for user, first page",
+            sessions_query(1).limit(21),
+            "ix_story_session_user_created",
+        ),
+        (
+            "sessions for user, page after a cursor",
+            sessions_query(1, (datetime(2024, 1, 1), 1000)).limit(21),
+            "ix_story_session_user_created",
+        ),
+    ]
+
+
+def explain(db, query) -> list[str]:
+    dialect = db.engine.dialect.name
+    sql = str(query.statement.compile(dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}))
+    prefix = "EXPLAIN QUERY PLAN " if dialect == "sqlite" else "EXPLAIN "
+    rows = db.session.execute(db.text(prefix + sql)).all()
+    # SQLite: (id, parent, notused, detail); Postgres: one text column per plan line
+    return [str(row[-1]) for row in rows]
+
+
+def problems(dialect: str, plan: list[str], index: str) -> list[str]:
+    text = "\n".join(plan)
+    found = []
+    if index not in text:
+        found.append(f"does not use {index}")
+    if dialect == "sqlite":
+        if any(line.startswith("SCAN ") and "USING" not in line for line in plan):
+            found.append("full table scan")
+        if "TEMP B-TREE" in text:
+            found.append("separate sort step")
+    else:
+        if "Seq Scan" in text:
+            found.append("sequential scan")
+        if "Sort" in text:
+            found.append("separate sort step")
+    return found
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--no-migrate", action="store_true", help="use DATABASE_URL as is instead of upgrading it first")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if not os.getenv("DATABASE_URL"):
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'plans.db')}"
+
+    from flask_migrate import Migrate, upgrade
+
+    from app import create_app, db
+
+    app = create_app()
+    Migrate(app, db)
+    failed = False
+    with app.app_context():
+        if not args.no_migrate:
+            upgrade(directory=os.path.join(ROOT, "migrations"))
+        dialect = db.engine.dialect.name
+        if dialect == "postgresql":
+            # Empty tables make a seq scan the cheapest plan; ask whether the index is usable at all
+            db.session.execute(db.text("SET enable_seqscan = off"))
+        print(f"dialect={dialect}")
+        for label, query, index in hot_queries():
+            plan = explain(db, query)
+            found = problems(dialect, plan, index)
+            failed = failed or bool(found)
+            print(f"{'FAIL' if found else 'ok  '}  {label}" + (f": {', '.join(found)}" if found else ""))
+            if args.verbose or found:
+                for line in plan:
+                    print(f"        {line}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for the Flask app.
+
+Creates the app in fresh interpreters under ``python -X importtime`` and
+reports wall-clock time, total import time and the heaviest top-level
+imports. The same runs time a baseline interpreter that only imports the
+frameworks the app cannot start without (Flask, Flask-SQLAlchemy,
+Flask-Login), and bench/startup_budget.json holds the app's allowed cost as
+a ratio to that baseline, so the budget carries over to slower or faster
+hosts. A regression fails the run (exit code 1).
+
+Ratios still shift when those frameworks or Python are upgraded: re-run
+with ``--update-budget`` then, and commit the new budget. ``--max-ratio``
+(or ``STARTUP_MAX_RATIO``) overrides the budget for one run.
+
+    python bench/startup.py                  # 5 runs, AI_PROVIDER from env or ollama
+    python bench/startup.py --provider gemini --runs 10
+    python bench/startup.py --json           # machine-readable, for tracking over time
+    python bench/startup.py --update-budget  # record current ratios (+25% headroom)
+    python bench/startup.py --max-ratio 3    # one-off limit, e.g. on a noisy CI host
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_PATH = os.path.join(ROOT, "bench", "startup_budget.json")
+SNIPPET = "from app import create_app; create_app()"
+BASELINE = "import flask, flask_sqlalchemy, flask_login"
+LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def run_once(env: dict, snippet: str = SNIPPET) -> tuple[float, dict[str, int]]:
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", snippet],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr[-2000:])
+        raise SystemExit(f"app startup failed (exit {proc.returncode})")
+    top_level: dict[str, int] = {}
+    for line in proc.stderr.splitlines():
+        m = LINE.match(line)
+        # Top-level imports are the ones importtime prints with a single space of indent
+        if m and len(m.group(3)) == 1:
+            top_level[m.group(4)] = int(m.group(2))
+    return wall, top_level
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--provider", default=os.getenv("AI_PROVIDER", "ollama"))
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--update-budget", action="store_true")
+    parser.add_argument(
+        "--max-ratio", type=float, default=float(os.getenv("STARTUP_MAX_RATIO", "0")) or None,
+        help="allowed app/baseline ratio for both wall and import time, instead of the recorded budget",
+    )
+    args = parser.parse_args()
+
+    env = dict(os.environ, AI_PROVIDER=args.provider, PYTHONDONTWRITEBYTECODE="0")
+    # Warm the bytecode cache so runs measure imports, not compilation
+    run_once(env)
+    run_once(env, BASELINE)
+    walls, imports, modules = [], [], {}
+    base_walls, base_imports = [], []
+    for _ in range(args.runs):
+        # Interleaved, so both see the same host load
+        wall, top_level = run_once(env, BASELINE)
+        base_walls.append(wall * 1000)
+        base_imports.append(sum(top_level.values()) / 1000)
+        wall, top_level = run_once(env)
+        walls.append(wall * 1000)
+        imports.append(sum(top_level.values()) / 1000)
+        for name, us in top_level.items():
+            modules.setdefault(name, []).append(us / 1000)
+
+    wall_ms, import_ms = statistics.median(walls), statistics.median(imports)
+    base_wall_ms, base_import_ms = statistics.median(base_walls), statistics.median(base_imports)
+    result = {
+        "provider": args.provider,
+        "runs": args.runs,
+        "wall_ms_median": round(wall_ms, 1),
+        "import_ms_median": round(import_ms, 1),
+        "baseline_wall_ms_median": round(base_wall_ms, 1),
+        "baseline_import_ms_median": round(base_import_ms, 1),
+        "wall_ratio": round(wall_ms / base_wall_ms, 2),
+        "import_ratio": round(import_ms / base_import_ms, 2),
+        "top_imports_ms": {
+            name: round(statistics.median(v), 1)
+            for name, v in sorted(modules.items(), key=lambda kv: -statistics.median(kv[1]))[: args.top]
+        },
+    }
+
+    budgets = {}
+    if os.path.exists(BUDGET_PATH):
+        with open(BUDGET_PATH) as f:
+            budgets = json.load(f)
+    if args.update_budget:
+        budgets[args.provider] = {
+            "wall_ratio": round(result["wall_ratio"] * 1.25, 2),
+            "import_ratio": round(result["import_ratio"] * 1.25, 2),
+        }
+        with open(BUDGET_PATH, "w") as f:
+            json.dump(budgets, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    budget = budgets.get(args.provider)
+    if args.max_ratio:
+        budget = {"wall_ratio": args.max_ratio, "import_ratio": args.max_ratio}
+    over = []
+    if budget:
+        if result["wall_ratio"] > budget["wall_ratio"]:
+            over.append(f"wall {result['wall_ratio']}x baseline > {budget['wall_ratio']}x")
+        if result["import_ratio"] > budget["import_ratio"]:
+            over.append(f"imports {result['import_ratio']}x baseline > {budget['import_ratio']}x")
+    result["budget"] = budget
+    result["over_budget"] = over
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"provider={args.provider} runs={args.runs}")
+        print(
+            f"wall median:    {wall_ms:8.1f} ms  baseline {base_wall_ms:8.1f} ms  = {result['wall_ratio']:.2f}x"
+            + (f"  (budget {budget['wall_ratio']}x)" if budget else "")
+        )
+        print(
+            f"imports median: {import_ms:8.1f} ms  baseline {base_import_ms:8.1f} ms  = {result['import_ratio']:.2f}x"
+            + (f"  (budget {budget['import_ratio']}x)" if budget else "")
+        )
+        print("heaviest top-level imports:")
+        for name, ms in result["top_imports_ms"].items():
+            print(f"  {ms:8.1f} ms  {name}")
+        for line in over:
+            print(f"OVER BUDGET: {line}")
+    return 1 if over else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,4 @@
+import json
 import os
 from dotenv import load_dotenv
 
@@ -13,6 +14,29 @@ except Exception:
 	pass
 
 
+def _flag(name: str, default: str = "false") -> bool:
+	return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "on")
+
+
+def _engine_options(uri: str) -> dict:
+	"""SQLAlchemy engine options for ``uri``, overridden by JSON in SQLALCHEMY_ENGINE_OPTIONS.
+
+	SQLite pragmas are applied per connection in ``create_app``; server
+	databases get a sized, pre-pinged and recycled connection pool.
+	"""
+	options: dict = {}
+	if not uri.startswith("sqlite"):
+		options = {
+			"pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+			"max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+			"pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+			"pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+			"pool_pre_ping": _flag("DB_POOL_PRE_PING", "true"),
+		}
+	options.update(json.loads(os.getenv("SQLALCHEMY_ENGINE_OPTIONS") or "{}"))
+	return options
+
+
 class Config:
 	SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret")
 	SQLALCHEMY_DATABASE_URI = os.getenv(
@@ -20,13 +44,31 @@ class Config:
 		f"sqlite:///{os.path.join(INSTANCE_PATH, 'app.db')}"
 	)
 	SQLALCHEMY_TRACK_MODIFICATIONS = False
+	SQLALCHEMY_ENGINE_OPTIONS = _engine_options(SQLALCHEMY_DATABASE_URI)
+	# SQLite connection pragmas: WAL lets readers proceed during a write and
+	# writers wait up to SQLITE_BUSY_TIMEOUT_MS for the lock instead of failing.
+	SQLITE_TUNING = _flag("SQLITE_TUNING", "true")
+	SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").strip().upper()
+	SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+	SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
 
 	# AI provider selection
 	AI_PROVIDER = os.getenv("AI_PROVIDER", "ollama")
 	OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 	GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+	# Which Gemini model works is probed lazily and cached on disk for all workers
+	GEMINI_PROBE_CACHE = os.getenv("GEMINI_PROBE_CACHE", os.path.join(INSTANCE_PATH, "gemini_model.json"))
+	GEMINI_PROBE_TTL = int(os.getenv("GEMINI_PROBE_TTL", str(24 * 3600)))
+	GEMINI_PROBE_LOCK_SECONDS = int(os.getenv("GEMINI_PROBE_LOCK_SECONDS", "120"))
+	# After a probe where no model answered, wait this long (doubling per failure, capped) before probing again
+	GEMINI_PROBE_BACKOFF = int(os.getenv("GEMINI_PROBE_BACKOFF", "30"))
+	GEMINI_PROBE_BACKOFF_MAX = int(os.getenv("GEMINI_PROBE_BACKOFF_MAX", "1800"))
 	OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://127.0.0.1:11434")
 	OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2")
+	# Continue each chapter from the KV context Ollama returned for the previous
+	# one; past OLLAMA_CONTEXT_MAX_TOKENS the full prompt is sent again.
+	OLLAMA_CONTEXT_REUSE = _flag("OLLAMA_CONTEXT_REUSE", "true")
+	OLLAMA_CONTEXT_MAX_TOKENS = int(os.getenv("OLLAMA_CONTEXT_MAX_TOKENS", "6144"))
 
 	# Local Stable Diffusion (AUTOMATIC1111 API)
 	SD_BASE_URL = os.getenv("SD_BASE_URL", "http://127.0.0.1:7860")
@@ -37,6 +79,119 @@ class Config:
 	# ComfyUI API plugin. Example: "http://127.0.0.1:8188"
 	COMFYUI_BASE_URL = os.getenv("COMFYUI_BASE_URL")
 
+	# HTTP transport to the local model servers: keep-alive pool sizes per
+	# backend, separate connect/read timeouts (seconds) and bounded retries
+	# with jittered backoff on connection errors.
+	OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "8"))
+	SD_POOL_SIZE = int(os.getenv("SD_POOL_SIZE", "4"))
+	HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+	OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "120"))
+	SD_READ_TIMEOUT = float(os.getenv("SD_READ_TIMEOUT", "180"))
+	HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+	HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.25"))
+
+	# Circuit breakers per Ollama model and image backend: open when the error
+	# rate over the last BREAKER_WINDOW calls reaches BREAKER_ERROR_RATE (after
+	# at least BREAKER_MIN_CALLS), stay open for BREAKER_COOLDOWN_SECONDS, and
+	# are probed in the background every HEALTH_PROBE_INTERVAL seconds.
+	BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+	BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "3"))
+	BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+	BREAKER_COOLDOWN_SECONDS = float(os.getenv("BREAKER_COOLDOWN_SECONDS", "30"))
+	HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "15"))
+	HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "30"))
+	LATENCY_EWMA_ALPHA = float(os.getenv("LATENCY_EWMA_ALPHA", "0.2"))
+
+	# Hedged chapter requests: if no valid chapter has come back after the
+	# target's HEDGE_PERCENTILE latency (HEDGE_DELAY_MS until it has answered
+	# BREAKER_MIN_CALLS times), the same prompt also goes to the next target
+	# (another Ollama model, an OLLAMA_HEDGE_URLS host or a HEDGE_PROVIDERS
+	# provider). At most HEDGE_MAX_ATTEMPTS run per chapter; the first valid one wins.
+	HEDGE_REQUESTS = _flag("HEDGE_REQUESTS")
+	HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+	HEDGE_DELAY_MS = int(os.getenv("HEDGE_DELAY_MS", "30000"))
+	HEDGE_MAX_ATTEMPTS = int(os.getenv("HEDGE_MAX_ATTEMPTS", "2"))
+	# Extra Ollama servers with the same models, e.g. "http://10.0.0.5:11434"
+	OLLAMA_HEDGE_URLS = [u.strip().rstrip("/") for u in os.getenv("OLLAMA_HEDGE_URLS", "").split(",") if u.strip()]
+	HEDGE_PROVIDERS = [p.strip().lower() for p in os.getenv("HEDGE_PROVIDERS", "").split(",") if p.strip()]
+
+	# Prometheus text metrics at /metrics (request, SQL and AI backend timings).
+	# Numbers are per process: scrape single-worker deployments. With
+	# METRICS_TOKEN set, scrapes must send "Authorization: Bearer <token>".
+	METRICS = _flag("METRICS")
+	METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+	# Server-Timing header (llm, sd, db and render time) on every response.
+	# Off by default: it shows any client how the server spends its time.
+	SERVER_TIMING = _flag("SERVER_TIMING")
+	# Profile this fraction of requests; those slower than PROFILE_SLOW_MS are
+	# written to PROFILE_DIR (cProfile .prof, or pyinstrument .html with PROFILER=pyinstrument)
+	PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+	PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "2000"))
+	PROFILER = os.getenv("PROFILER", "cprofile").lower()
+	PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(INSTANCE_PATH, "profiles"))
+
+	# Character extraction cache: DB rows live for CHARACTER_CACHE_TTL seconds,
+	# fronted by an in-process LRU of CHARACTER_CACHE_LRU_SIZE titles.
+	CHARACTER_CACHE_TTL = int(os.getenv("CHARACTER_CACHE_TTL", str(30 * 24 * 3600)))
+	CHARACTER_CACHE_LRU_SIZE = int(os.getenv("CHARACTER_CACHE_LRU_SIZE", "256"))
+
+	# Background generation: chapters are produced by a per-process worker pool
+	# and the page polls for completion instead of blocking the request.
+	ASYNC_GENERATION = _flag("ASYNC_GENERATION", "true")
+	JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+	JOB_TIMEOUT_SECONDS = int(os.getenv("JOB_TIMEOUT_SECONDS", "600"))
+	# Each process marks its jobs alive this often; a job whose process has
+	# missed three heartbeats is re-queued without waiting for JOB_TIMEOUT_SECONDS
+	JOB_HEARTBEAT_SECONDS = int(os.getenv("JOB_HEARTBEAT_SECONDS", "10"))
+
+	# Stream chapter text to the browser over Server-Sent Events as it is
+	# generated. Takes precedence over ASYNC_GENERATION for new chapters.
+	STREAM_CHAPTERS = _flag("STREAM_CHAPTERS")
+
+	# Render chapter illustrations after the text is saved instead of inline
+	ASYNC_IMAGES = _flag("ASYNC_IMAGES", "true")
+	IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+	IMAGE_TIMEOUT_SECONDS = int(os.getenv("IMAGE_TIMEOUT_SECONDS", "600"))
+	# Where generated images and uploads are written; served at /static/generated/
+	# either way. Defaults to app/static/generated.
+	IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR")
+	# Responsive copies written beside each generated image (needs Pillow).
+	# IMAGE_VARIANT_FORMAT may be "avif" where Pillow was built with libavif.
+	IMAGE_VARIANTS = _flag("IMAGE_VARIANTS", "true")
+	IMAGE_VARIANT_FORMAT = os.getenv("IMAGE_VARIANT_FORMAT", "webp").strip().lower()
+	IMAGE_VARIANT_WIDTHS = [int(w) for w in os.getenv("IMAGE_VARIANT_WIDTHS", "384,768").split(",") if w.strip()]
+	IMAGE_THUMB_WIDTH = int(os.getenv("IMAGE_THUMB_WIDTH", "160"))
+	IMAGE_VARIANT_QUALITY = int(os.getenv("IMAGE_VARIANT_QUALITY", "80"))
+
+	# Rolling story state fed to each chapter prompt instead of the full history
+	STORY_SUMMARY_MAX_CHARS = int(os.getenv("STORY_SUMMARY_MAX_CHARS", "900"))
+	STORY_FACTS_MAX = int(os.getenv("STORY_FACTS_MAX", "8"))
+
+	# Adventure lists (index, profile, /api/sessions) are paged by cursor
+	SESSIONS_PAGE_SIZE = int(os.getenv("SESSIONS_PAGE_SIZE", "20"))
+	SESSIONS_PAGE_MAX = int(os.getenv("SESSIONS_PAGE_MAX", "100"))
+
+	# Session summary page: chapters are streamed in batches of
+	# SESSION_STREAM_BATCH; set SESSION_CHAPTERS_PER_PAGE to split it into pages.
+	SESSION_STREAM_BATCH = int(os.getenv("SESSION_STREAM_BATCH", "10"))
+	SESSION_CHAPTERS_PER_PAGE = int(os.getenv("SESSION_CHAPTERS_PER_PAGE", "0"))
+
+	# Story length
+	MAX_CHAPTERS = int(os.getenv("MAX_CHAPTERS", "30"))
+
+	# Speculative prefetch: generate chapter N+1 for all three choices while
+	# the reader is still on chapter N.
+	PREFETCH_CHAPTERS = _flag("PREFETCH_CHAPTERS")
+	PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "3"))
+	# How long a choice waits for its in-flight candidate before generating inline
+	PREFETCH_WAIT_SECONDS = float(os.getenv("PREFETCH_WAIT_SECONDS", "150"))
+
+	# Shared story tree: chapters generated for one reader are stored by
+	# (book, character, choice path) and copied to anyone who takes the same path.
+	# Opening chapters from `flask pregenerate` are served either way.
+	SHARED_STORY_TREE = _flag("SHARED_STORY_TREE")
+
 	# Google OAuth
 	GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 	GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
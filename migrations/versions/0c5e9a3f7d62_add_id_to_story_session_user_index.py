@@ -0,0 +1,28 @@
+"""add id to story_session user index for keyset paging
+
+Revision ID: 0c5e9a3f7d62
+Revises: f2a86d0c7b31
+Create Date: 2026-10-17 19:48:30.218774
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0c5e9a3f7d62'
+down_revision = 'f2a86d0c7b31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('story_session', schema=None) as batch_op:
+        batch_op.drop_index('ix_story_session_user_created')
+        batch_op.create_index('ix_story_session_user_created', ['user_id', sa.text('created_at DESC'), sa.text('id DESC')], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('story_session', schema=None) as batch_op:
+        batch_op.drop_index('ix_story_session_user_created')
+        batch_op.create_index('ix_story_session_user_created', ['user_id', sa.text('created_at DESC')], unique=False)
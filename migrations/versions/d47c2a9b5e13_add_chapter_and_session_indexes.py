@@ -0,0 +1,38 @@
+"""add chapter and story_session lookup indexes
+
+Revision ID: d47c2a9b5e13
+Revises: b81f4d2e6a90
+Create Date: 2026-10-17 18:12:55.904417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd47c2a9b5e13'
+down_revision = 'b81f4d2e6a90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Racing generators could save the same chapter twice; keep the oldest row
+    # so the unique index can be built.
+    op.execute(
+        "DELETE FROM chapter WHERE id NOT IN "
+        "(SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM chapter GROUP BY session_id, number) AS keep)"
+    )
+    with op.batch_alter_table('chapter', schema=None) as batch_op:
+        batch_op.create_index('uq_chapter_session_number', ['session_id', 'number'], unique=True)
+
+    with op.batch_alter_table('story_session', schema=None) as batch_op:
+        batch_op.create_index('ix_story_session_user_created', ['user_id', sa.text('created_at DESC')], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('story_session', schema=None) as batch_op:
+        batch_op.drop_index('ix_story_session_user_created')
+
+    with op.batch_alter_table('chapter', schema=None) as batch_op:
+        batch_op.drop_index('uq_chapter_session_number')